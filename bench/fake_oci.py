@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+from bisect import bisect_left
+import oci
+import pytz
+import builtins
+import time
+import random
+import hashlib
+import threading
+
+#
+# In-memory stand-in for oci.object_storage.ObjectStorageClient holding a synthetic movie
+# bucket.  Only the calls the app makes are implemented, and they return the same model and
+# response types as the SDK.  Every call sleeps for latency seconds (plus up to jitter seconds)
+# to model the round trip to object storage, and is counted in calls.  Response headers use the
+# lowercase names the SDK returns.  The same seed always produces the same bucket.
+#
+# The bucket has folders folder00/, folder01/, ... each with titles_per_folder titles.  Every
+# hls_every-th title is an HLS folder (title.hls/output.m3u8 and segments output000.ts, ...),
+# the others are mp4 files.
+#
+class FakeObjectStorageClient:
+    LIST_LIMIT = 1000
+
+    def __init__(self, folders: int = 4, titles_per_folder: int = 200, hls_every: int = 4, segments: int = 600, segment_size: int = 2*1024*1024, latency: float = 0.02, jitter: float = 0.01, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.pars = {}
+        self.segments = segments
+        rng = random.Random(seed)
+        created = datetime(2020, 1, 1, tzinfo=pytz.utc)
+        self.objects = {}
+        for folder in range(folders):
+            for title in range(titles_per_folder):
+                created += timedelta(hours=1)
+                base = f"folder{folder:02}/Title {folder:02}-{title:04} {rng.choice(('Summer', 'Winter', 'Birthday', 'Holiday', 'Trip'))}"
+                if hls_every and title % hls_every == 0:
+                    self._add(f"{base}.hls/output.m3u8", 30 * segments, created)
+                    for segment in range(segments):
+                        self._add(f"{base}.hls/output{segment:03}.ts", segment_size, created)
+                else:
+                    self._add(f"{base}.mp4", rng.randint(200, 4000) * 1024 * 1024, created)
+        self.names = sorted(self.objects)
+
+    def _add(self, name: str, size: int, created: datetime):
+        etag = hashlib.md5(name.encode("utf-8")).hexdigest()
+        self.objects[name] = oci.object_storage.models.ObjectSummary(name=name, size=size, etag=etag, time_created=created, time_modified=created, storage_tier="Standard")
+
+    def _call(self, method: str):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+
+    # titles the app shows: mp4 files and HLS playlists
+    def videos(self) -> list:
+        return [name for name in self.names if name.endswith(".mp4") or name.endswith(".m3u8")]
+
+    def get_namespace(self, **kwargs):
+        self._call("get_namespace")
+        return oci.response.Response(200, {}, "benchns", None)
+
+    def list_objects(self, namespace_name, bucket_name, prefix=None, start=None, delimiter=None, fields=None, limit=None, **kwargs):
+        self._call("list_objects")
+        prefix = prefix or ""
+        limit = min(limit or self.LIST_LIMIT, self.LIST_LIMIT)
+        objects = []
+        prefixes = []
+        next_start_with = None
+        # walk the sorted names starting at start, collapsing anything below the delimiter
+        index = bisect_left(self.names, max(prefix, start or ""))
+        while index < len(self.names) and self.names[index].startswith(prefix):
+            name = self.names[index]
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                sub_prefix = prefix + rest.split(delimiter, 1)[0] + delimiter
+                prefixes.append(sub_prefix)
+                # skip every object under the sub-folder
+                index = bisect_left(self.names, sub_prefix + "\uffff")
+                continue
+            if len(objects) >= limit:
+                next_start_with = name
+                break
+            objects.append(self.objects[name])
+            index += 1
+        data = oci.object_storage.models.ListObjects(objects=objects, prefixes=prefixes, next_start_with=next_start_with)
+        return oci.response.Response(200, {}, data, None)
+
+    def head_object(self, namespace_name, bucket_name, object_name, **kwargs):
+        self._call("head_object")
+        object_file = self._get(object_name)
+        headers = {
+            "etag": object_file.etag,
+            "content-length": str(object_file.size),
+            "last-modified": object_file.time_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+        }
+        return oci.response.Response(200, headers, None, None)
+
+    def get_object(self, namespace_name, bucket_name, object_name, range=None, **kwargs):
+        self._call("get_object")
+        object_file = self._get(object_name)
+        if object_name.endswith(".m3u8"):
+            lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4"]
+            # range is shadowed by the SDK's keyword argument
+            for segment in builtins.range(self.segments):
+                lines += ["#EXTINF:4.0,", f"output{segment:03}.ts"]
+            body = ("\n".join(lines + ["#EXT-X-ENDLIST"]) + "\n").encode("utf-8")
+        else:
+            start, stop = 0, object_file.size
+            if range:
+                first, last = range.split("=", 1)[1].split("-")
+                start, stop = int(first), min(int(last) + 1, object_file.size)
+            body = bytes(stop - start)
+        headers = {"etag": object_file.etag, "content-length": str(len(body))}
+        return oci.response.Response(200, headers, FakeBody(body), None)
+
+    def create_preauthenticated_request(self, namespace_name, bucket_name, create_preauthenticated_request_details, **kwargs):
+        self._call("create_preauthenticated_request")
+        details = create_preauthenticated_request_details
+        par_id = hashlib.sha1(f"{details.name}{time.time()}{random.random()}".encode("utf-8")).hexdigest()
+        par = oci.object_storage.models.PreauthenticatedRequest(
+            id=par_id,
+            name=details.name,
+            access_uri=f"/p/{par_id}/n/{namespace_name}/b/{bucket_name}/o/",
+            object_name=details.object_name,
+            access_type=details.access_type,
+            time_created=datetime.now(details.time_expires.tzinfo),
+            time_expires=details.time_expires)
+        with self.lock:
+            self.pars[par_id] = par
+        return oci.response.Response(200, {}, par, None)
+
+    def list_preauthenticated_requests(self, namespace_name, bucket_name, page=None, limit=100, **kwargs):
+        self._call("list_preauthenticated_requests")
+        with self.lock:
+            pars = sorted(self.pars.values(), key=lambda par: par.id)
+        start = int(page or 0)
+        headers = {}
+        if start + limit < len(pars):
+            headers["opc-next-page"] = str(start + limit)
+        return oci.response.Response(200, headers, pars[start:start + limit], None)
+
+    def delete_preauthenticated_request(self, namespace_name, bucket_name, par_id, **kwargs):
+        self._call("delete_preauthenticated_request")
+        with self.lock:
+            self.pars.pop(par_id, None)
+        return oci.response.Response(204, {}, None, None)
+
+    def _get(self, object_name: str):
+        object_file = self.objects.get(object_name)
+        if object_file is None:
+            raise oci.exceptions.ServiceError(404, "ObjectNotFound", {}, f"The object '{object_name}' was not found")
+        return object_file
+
+#
+# the parts of a requests.Response the app reads from get_object
+#
+class FakeBody:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.raw = self
+
+    def stream(self, amount: int, decode_content: bool = None):
+        for position in range(0, len(self.content), amount):
+            yield self.content[position:position + amount]
+
+    def close(self):
+        pass
@@ -0,0 +1,258 @@
+#
+# Offline benchmark of the app against a fake object storage bucket and a local Redis.
+#
+# The app is built exactly as app.py builds it (same flags and defaults) but with the
+# FakeObjectStorageClient, and driven in-process through Flask test clients from a pool of
+# threads, so no OCI tenancy or network is needed.  With --cache redis or tiered the app talks
+# to a real Redis at --redis-url, or to a fakeredis TCP server started on a free port.
+#
+# usage: python bench/run.py [--scenarios browse,open,qr_storm,share_burst] [--cache local]
+#            [--concurrency 16] [--operations 2000] [--titles 200] [--folders 4] [--latency 20]
+#            [--json results.json] [--baseline baseline.json] [-- app.py flags...]
+#
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python_app"))
+
+from fake_oci import FakeObjectStorageClient
+from flask_qrcode import QRcode
+from app import build_parser
+from service import create_app
+
+USERNAME = "bench"
+PASSWORD = "bench"
+SEARCH_WORDS = ("summer", "winter", "birth", "holiday", "trip", "title 01", "00")
+
+#
+# each scenario has a setup run once with a logged in client, and an operation run
+# operations times across the thread pool.  an operation is one user action and may make
+# several requests; its latency is the time for all of them
+#
+class Scenario(ABC):
+    def __init__(self, bucket: FakeObjectStorageClient):
+        self.bucket = bucket
+        self.videos = bucket.videos()
+        self.folders = sorted({name.split("/", 1)[0] for name in self.videos})
+
+    def setup(self, client):
+        pass
+
+    # returns the responses of the requests the operation made
+    @abstractmethod
+    def operation(self, client, rng: random.Random) -> list:
+        pass
+
+# page through the home page, the json catalog and search
+class BrowseScenario(Scenario):
+    def operation(self, client, rng):
+        choice = rng.randrange(3)
+        folder = rng.choice(self.folders)
+        if choice == 0:
+            return [client.get(f"/?tab={folder}&page={rng.randint(1, 4)}")]
+        if choice == 1:
+            return [client.get(f"/api/catalog?folder={folder}&sort={rng.choice(('name', 'time_created', 'size'))}&page={rng.randint(1, 4)}")]
+        return [client.get(f"/search?q={rng.choice(SEARCH_WORDS)}")]
+
+# open random titles; HLS titles also load their playlist like a player would
+class OpenScenario(Scenario):
+    def operation(self, client, rng):
+        name = rng.choice(self.videos)
+        responses = [client.get("/movie", query_string={"name": name})]
+        if name.endswith(".m3u8"):
+            responses.append(client.get("/playlist", query_string={"name": name}))
+        return responses
+
+# many devices showing the QR login page and polling check_auth; now and then a phone
+# completes one of the logins
+class QrStormScenario(Scenario):
+    SESSIONS = 200
+
+    def setup(self, client):
+        self.sessions = []
+        for _ in range(self.SESSIONS):
+            page = client.get("/login").get_data(as_text=True)
+            self.sessions.append(re.search(r"session_id=([0-9a-f-]+)", page).group(1))
+
+    def operation(self, client, rng):
+        session_id = rng.choice(self.sessions)
+        if rng.random() < 0.02:
+            return [client.post("/authenticate", data={"session_id": session_id, "username": USERNAME, "password": PASSWORD})]
+        return [client.get("/check_auth", query_string={"session_id": session_id})]
+
+# create a share link and open it straight away
+class ShareBurstScenario(Scenario):
+    def operation(self, client, rng):
+        name = rng.choice(self.videos)
+        created = client.post("/share_url", json={"name": name})
+        # i.e. 429 with --rate_limit, since every benchmark client has the same address
+        if created.status_code != 200:
+            return [created]
+        url = created.get_json()["url"]
+        return [client.get("/shared", query_string={"auth_code": url.rsplit("auth_code=", 1)[1]})]
+
+SCENARIOS = {
+    "browse": BrowseScenario,
+    "open": OpenScenario,
+    "qr_storm": QrStormScenario,
+    "share_burst": ShareBurstScenario,
+}
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def logged_in_client(app):
+    client = app.test_client()
+    client.post("/login", data={"username": USERNAME, "password": PASSWORD})
+    return client
+
+def run_scenario(app, scenario: Scenario, concurrency: int, operations: int, seed: int) -> dict:
+    scenario.setup(logged_in_client(app))
+    scenario.bucket.reset_calls()
+
+    local = threading.local()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run_one(index):
+        if not hasattr(local, "client"):
+            local.client = logged_in_client(app)
+        rng = random.Random(seed * 1000003 + index)
+        started = time.perf_counter()
+        responses = scenario.operation(local.client, rng)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors[0] += sum(1 for response in responses if response.status_code >= 400)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_one, range(operations)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "operations": operations,
+        "errors": errors[0],
+        "seconds": round(duration, 3),
+        "throughput": round(operations / duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "oci_calls": dict(sorted(scenario.bucket.calls.items())),
+    }
+
+def start_fake_redis() -> int:
+    from fakeredis import TcpFakeServer
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    # connection handler threads must not keep the benchmark from exiting
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-redis", daemon=True).start()
+    return port
+
+def build_app(options, app_args: list):
+    bucket = FakeObjectStorageClient(folders=options.folders, titles_per_folder=options.titles, hls_every=options.hls_every, segments=options.segments, latency=options.latency / 1000, jitter=options.jitter / 1000, seed=options.seed)
+    work_dir = tempfile.mkdtemp(prefix="homemovies-bench-")
+    args = ["--bucket", "bench", "--username", USERNAME, "--password", PASSWORD, "--os_endpoint", "https://objectstorage.example.com",
+            "--stream_cache_dir", os.path.join(work_dir, "chunks"), "--prefetch_cache_dir", os.path.join(work_dir, "prefetch")]
+    if options.cache in ("local", "file"):
+        args.append("--local_cache")
+    else:
+        if options.redis_url:
+            args += ["--redis-url", options.redis_url]
+        else:
+            args += ["--redis-url", "127.0.0.1", "--redis_port", str(start_fake_redis())]
+        args.append("--redis_no_ssl")
+        if options.cache == "tiered":
+            args.append("--tiered_cache")
+    cmd = build_parser().parse_args(args + app_args)
+    cmd.use_file_cache = options.cache == "file"
+    if cmd.use_file_cache:
+        cmd.use_local_cache = False
+        cmd.cache_file = os.path.join(work_dir, "cache.db")
+
+    started = time.perf_counter()
+    app = create_app(cmd, bucket, "benchns")
+    QRcode(app)
+    logging.getLogger().setLevel(logging.WARNING)
+    startup = time.perf_counter() - started
+    return app, bucket, startup
+
+def print_results(results: dict, baseline: dict = None):
+    header = f"{'scenario':<12} {'ops':>6} {'errors':>6} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  oci calls"
+    print(header)
+    print("-" * len(header))
+    for name, result in results["scenarios"].items():
+        print(f"{name:<12} {result['operations']:>6} {result['errors']:>6} {result['throughput']:>9} {result['p50_ms']:>9} {result['p99_ms']:>9} {result['max_ms']:>9}  {result['oci_calls']}")
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if base:
+            print(f"{'  vs base':<12} {'':>6} {'':>6} {_change(result['throughput'], base['throughput']):>9} {_change(result['p50_ms'], base['p50_ms']):>9} {_change(result['p99_ms'], base['p99_ms']):>9}")
+    print(f"startup (catalog build) {results['startup_ms']} ms")
+
+def _change(value: float, base: float) -> str:
+    if not base:
+        return "n/a"
+    return f"{(value - base) / base * 100:+.1f}%"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of flask-homemovies", epilog="Arguments after -- are passed to the app as app.py flags, i.e. -- --stream --tiered_cache")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios to run: " + ", ".join(SCENARIOS))
+    parser.add_argument("--cache", choices=("local", "file", "redis", "tiered"), default="local", help="Cache provider used by the app")
+    parser.add_argument("--redis-url", default=None, dest="redis_url", help="Redis host for --cache redis/tiered (default: start a fakeredis server)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--operations", type=int, default=2000, help="Operations per scenario")
+    parser.add_argument("--folders", type=int, default=4, help="Folders in the fake bucket")
+    parser.add_argument("--titles", type=int, default=200, help="Titles per folder")
+    parser.add_argument("--hls_every", type=int, default=4, help="Every Nth title is HLS (0 for none)")
+    parser.add_argument("--segments", type=int, default=600, help="Segments per HLS title")
+    parser.add_argument("--latency", type=float, default=20, help="Milliseconds added to every object storage call")
+    parser.add_argument("--jitter", type=float, default=10, help="Up to this many random milliseconds added to the latency")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the bucket and the operations")
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    parser.add_argument("--baseline", default=None, help="Compare with results written earlier with --json")
+    argv = sys.argv[1:]
+    app_args = []
+    if "--" in argv:
+        app_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    options = parser.parse_args(argv)
+
+    app, bucket, startup = build_app(options, app_args)
+    results = {
+        "options": vars(options),
+        "app_args": app_args,
+        "startup_ms": round(startup * 1000, 1),
+        "scenarios": {},
+    }
+    for name in options.scenarios.split(","):
+        scenario = SCENARIOS[name.strip()](bucket)
+        results["scenarios"][name] = run_scenario(app, scenario, options.concurrency, options.operations, options.seed)
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if options.json:
+        with open(options.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+if __name__ == "__main__":
+    main()
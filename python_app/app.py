@@ -1,30 +1,25 @@
-import oci
 import sys
-import base64
+
+# gevent workers multiplex many requests on a single thread by patching blocking network calls
+# (including the OCI SDK and Redis clients) to yield while they wait.  the patch has to happen
+# before oci, requests and ssl are imported
+if "--worker_class=gevent" in sys.argv or ("--worker_class", "gevent") in zip(sys.argv, sys.argv[1:]):
+    from gevent import monkey
+    monkey.patch_all()
+
+import oci
 import argparse
 from flask_qrcode import QRcode
 from service import create_app
+from server import serve
+from bootstrap import BootSnapshot, bootstrap, start_revalidation
+import logging
 
-if __name__ == "__main__":
-    # get variables from parser
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--local_cache', action='store_true', default=False, dest='use_local_cache', help='Use local (in-process) cache instead of OCI Redis')
-    parser.add_argument('--instance_principal', action='store_true', default=False, dest='use_instance_principal', help='Use Instance Principals for Authentication')
-    parser.add_argument('--resource_principal', action='store_true', default=False, dest='use_resource_principal', help='Use Resource Principals for Authentication')
-    parser.add_argument('--secret', default="", dest='secret', help='OCID of compartment with secrets vault')
-    parser.add_argument('--os_endpoint', default="https://objectstorage.us-ashburn-1.oraclecloud.com", dest='os_endpoint', help='Object Storage Endpoint')
-    parser.add_argument('--redis-url', default="", dest='redis_url', help='Redis URL')
-    parser.add_argument('--bucket', default="", dest='bucket', help='Bucket Name')
-    parser.add_argument('--username', default="", dest='username', help='Username')
-    parser.add_argument('--password', default="", dest='password', help='Password')
-    cmd = parser.parse_args()
-
-    # exit if required parameters and not specified
-    if len(sys.argv) < 1:
-        parser.print_help()
-        raise SystemExit
-
-    # build object storage client whether config file based on instance principal
+#
+# build the OCI config and signer.  called once in the main process and again in every
+# production worker so that no OCI sessions are shared across a fork
+#
+def build_config(cmd):
     if cmd.use_instance_principal:
         try:
             signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
@@ -59,36 +54,97 @@ if __name__ == "__main__":
             print("Error building config for SDK config, aborting")
             raise SystemExit
 
-    # If --secret passed in derive username, password, bucket from secret
-    if cmd.secret:
-        try:
-            vault_client = oci.vault.VaultsClient(config=config, signer=signer)
-            secret_client = oci.secrets.SecretsClient(config=config, signer=signer)
-
-            secrets_list = vault_client.list_secrets(cmd.secret)
-            for secret in secrets_list.data:
-                response = secret_client.get_secret_bundle(secret.id)
-                base64_Secret_content = response.data.secret_bundle_content.content
-                base64_secret_bytes = base64_Secret_content.encode('ascii')
-                base64_message_bytes = base64.b64decode(base64_secret_bytes)
-                secret_content = base64_message_bytes.decode('ascii')
-                match secret.secret_name:
-                    case "username":
-                        cmd.username = secret_content
-                    case "password":
-                        cmd.password = secret_content
-                    case "bucket":
-                        cmd.bucket = secret_content
-                    case "redis-url":
-                        cmd.redis_url = secret_content
-        except Exception as e:
-            print(e)
-            print("Error building retrieving vaults and secrets, aborting")
-            raise SystemExit
+    return config, signer
 
-    # build the object storage client   
+#
+# command line arguments.  also used by the benchmark harness to build a configuration
+#
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--local_cache', action='store_true', default=False, dest='use_local_cache', help='Use local (in-process) cache instead of OCI Redis')
+    parser.add_argument('--tiered_cache', action='store_true', default=False, dest='use_tiered_cache', help='Front the OCI Redis cache with a bounded in-process cache')
+    parser.add_argument('--local_cache_max_entries', type=int, default=10000, dest='local_cache_max_entries', help='Maximum entries per in-process cache before least recently used entries are evicted')
+    parser.add_argument('--local_cache_ttl', type=int, default=300, dest='local_cache_ttl', help='Maximum seconds an entry is served from the in-process tier of the tiered cache')
+    parser.add_argument('--stream', action='store_true', default=False, dest='use_stream', help='Stream video through the app from a local chunk cache instead of directly from object storage')
+    parser.add_argument('--stream_cache_dir', default="/tmp/flask-homemovies-chunks", dest='stream_cache_dir', help='Directory of the streaming chunk cache')
+    parser.add_argument('--stream_cache_size', type=int, default=10240, dest='stream_cache_size', help='Maximum size in MB of the streaming chunk cache')
+    parser.add_argument('--stream_chunk_size', type=int, default=8, dest='stream_chunk_size', help='Size in MB of each chunk read from object storage and cached')
+    parser.add_argument('--prefetch', action='store_true', default=False, dest='use_prefetch', help='Prefetch upcoming HLS segments into a local segment store (requires --stream)')
+    parser.add_argument('--prefetch_cache_dir', default="/tmp/flask-homemovies-prefetch", dest='prefetch_cache_dir', help='Directory of the prefetched segment store')
+    parser.add_argument('--prefetch_cache_size', type=int, default=2048, dest='prefetch_cache_size', help='Maximum size in MB of the prefetched segment store')
+    parser.add_argument('--prefetch_segments', type=int, default=3, dest='prefetch_segments', help='Segments prefetched when a movie page is opened')
+    parser.add_argument('--prefetch_window', type=int, default=5, dest='prefetch_window', help='Segments kept prefetched ahead of the last one played')
+    parser.add_argument('--prefetch_workers', type=int, default=4, dest='prefetch_workers', help='Maximum concurrent prefetch downloads per worker process')
+    parser.add_argument('--prefetch_idle_timeout', type=int, default=60, dest='prefetch_idle_timeout', help='Seconds without segment requests before a viewer\'s prefetches are cancelled')
+    parser.add_argument('--server', default="dev", choices=["dev", "production"], dest='server', help='Serve with the single process Flask development server or multi-process production server')
+    parser.add_argument('--workers', type=int, default=2, dest='workers', help='Number of worker processes in production mode')
+    parser.add_argument('--threads', type=int, default=8, dest='threads', help='Number of threads per worker process in production mode')
+    parser.add_argument('--worker_class', default="gthread", choices=["gthread", "gevent"], dest='worker_class', help='Production worker type: thread pool (gthread) or cooperative (gevent) workers')
+    parser.add_argument('--worker_connections', type=int, default=1000, dest='worker_connections', help='Maximum concurrent connections per gevent worker')
+    parser.add_argument('--cache_file', default="/tmp/flask-homemovies-cache.db", dest='cache_file', help='File backing the shared cache when local cache is used with multiple workers')
+    parser.add_argument('--par_reaper', action='store_true', default=False, dest='use_par_reaper', help='Delete expired pre-authenticated requests in a background worker')
+    parser.add_argument('--instance_principal', action='store_true', default=False, dest='use_instance_principal', help='Use Instance Principals for Authentication')
+    parser.add_argument('--resource_principal', action='store_true', default=False, dest='use_resource_principal', help='Use Resource Principals for Authentication')
+    parser.add_argument('--secret', default="", dest='secret', help='OCID of compartment with secrets vault')
+    parser.add_argument('--os_endpoint', default="https://objectstorage.us-ashburn-1.oraclecloud.com", dest='os_endpoint', help='Object Storage Endpoint')
+    parser.add_argument('--redis-url', default="", dest='redis_url', help='Redis URL')
+    parser.add_argument('--redis_port', type=int, default=6379, dest='redis_port', help='Redis port')
+    parser.add_argument('--redis_max_connections', type=int, default=50, dest='redis_max_connections', help='Size of the Redis connection pool per worker process')
+    parser.add_argument('--redis_timeout', type=float, default=5, dest='redis_timeout', help='Seconds to wait for a Redis connection, connect or reply')
+    parser.add_argument('--redis_health_check_interval', type=int, default=30, dest='redis_health_check_interval', help='Seconds a pooled Redis connection may sit idle before it is health checked')
+    parser.add_argument('--redis_no_ssl', action='store_true', default=False, dest='redis_no_ssl', help='Connect to Redis without TLS')
+    parser.add_argument('--redis_ssl_cert_reqs', default="none", choices=["none", "optional", "required"], dest='redis_ssl_cert_reqs', help='Verification of the Redis server certificate')
+    parser.add_argument('--redis_ca_certs', default=None, dest='redis_ca_certs', help='CA bundle used to verify the Redis server certificate')
+    parser.add_argument('--bucket', default="", dest='bucket', help='Bucket Name')
+    parser.add_argument('--username', default="", dest='username', help='Username')
+    parser.add_argument('--password', default="", dest='password', help='Password')
+    parser.add_argument('--catalog_ttl', type=int, default=300, dest='catalog_ttl', help='Seconds between background refreshes of the catalog index')
+    parser.add_argument('--list_workers', type=int, default=8, dest='list_workers', help='Number of folders listed in parallel when building the catalog index')
+    parser.add_argument('--catalog_full_refresh', type=int, default=86400, dest='catalog_full_refresh', help='Seconds between catalog refreshes that also re-read every HLS playlist')
+    parser.add_argument('--events_token', default=None, dest='events_token', help='Token required by the /events/object webhook; the webhook is disabled without it')
+    parser.add_argument('--boot_snapshot', default=None, dest='boot_snapshot', help='File holding the namespace, secrets and catalog of the last run so the app can start without waiting on OCI')
+    parser.add_argument('--debug', action='store_true', default=False, dest='debug', help='Enable debug logging')
+    parser.add_argument('--server_timing', action='store_true', default=False, dest='server_timing', help='Add a Server-Timing header with app, object storage and cache time to every response')
+    parser.add_argument('--metrics_token', default=None, dest='metrics_token', help='Bearer token that lets a scraper read /metrics without logging in')
+    parser.add_argument('--par_lifetime', type=int, default=240, dest='par_lifetime', help='Lifetime in minutes of newly created pre-authenticated requests')
+    parser.add_argument('--par_min_remaining', type=int, default=120, dest='par_min_remaining', help='Minimum remaining lifetime in minutes for a pooled pre-authenticated request to be reused')
+    parser.add_argument('--par_reaper_interval', type=int, default=900, dest='par_reaper_interval', help='Seconds between background sweeps for expired pre-authenticated requests')
+    parser.add_argument('--par_reaper_batch', type=int, default=10, dest='par_reaper_batch', help='Maximum expired pre-authenticated requests deleted per second')
+    parser.add_argument('--metadata', action='store_true', default=False, dest='use_metadata', help='Compute duration, resolution, renditions and a poster of every title in the background (posters and probing need ffmpeg)')
+    parser.add_argument('--metadata_workers', type=int, default=2, dest='metadata_workers', help='Processes used to probe titles and grab posters')
+    parser.add_argument('--metadata_interval', type=int, default=600, dest='metadata_interval', help='Seconds between checks for titles without metadata when the catalog has not changed')
+    parser.add_argument('--rate_limit', action='store_true', default=False, dest='use_rate_limit', help='Limit how fast each client may open, share and log in (per route, shared by all workers through the cache)')
+    parser.add_argument('--rate_limit_rate', type=float, default=1, dest='rate_limit_rate', help='Requests per second each client may make to a rate limited route')
+    parser.add_argument('--rate_limit_burst', type=int, default=20, dest='rate_limit_burst', help='Requests a client may make to a rate limited route at once before --rate_limit_rate applies')
+    parser.add_argument('--proxy_count', type=int, default=0, dest='proxy_count', help='Number of load balancers/proxies in front of the app whose X-Forwarded-For and X-Forwarded-Proto headers are trusted')
+    return parser
+
+if __name__ == "__main__":
+    # get variables from parser
+    parser = build_parser()
+    cmd = parser.parse_args()
+    cmd.use_file_cache = False
+
+    # exit if required parameters and not specified
+    if len(sys.argv) < 1:
+        parser.print_help()
+        raise SystemExit
+
+    config, signer = build_config(cmd)
+
+    # resolve the namespace and (with --secret) username, password, bucket and redis url from
+    # the vault.  with a boot snapshot the values from the last run are used straight away and
+    # revalidated in the background
+    snapshot = None
+    if cmd.boot_snapshot:
+        snapshot = BootSnapshot(cmd.boot_snapshot, {"secret": cmd.secret, "bucket": cmd.bucket})
     os_client = oci.object_storage.ObjectStorageClient(config, signer=signer)
-    namespace = os_client.get_namespace(retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY).data
+    try:
+        namespace = bootstrap(cmd, config, signer, os_client, snapshot, revalidate=cmd.server != "production")
+    except Exception as e:
+        print(e)
+        print("Error retrieving namespace, vaults and secrets, aborting")
+        raise SystemExit
 
     if not (cmd.username and cmd.password):
         print("Username and password parameters are required. Pass in as arguments or derive from a secret.\n")
@@ -100,10 +156,35 @@ if __name__ == "__main__":
         parser.print_help()
         raise SystemExit
 
-    # create flask app, enable QR generation, and run
-    app = create_app(cmd, os_client, namespace)
-    QRcode(app)
-    app.run(host="0.0.0.0", port=5000)
+    if cmd.use_prefetch and not cmd.use_stream:
+        print("Prefetch requires streaming through the app (--stream).\n")
+        parser.print_help()
+        raise SystemExit
+
+    # create flask app, enable QR generation, and run.  production workers each build their own
+    # app after the fork so that OCI clients, cache connections and background threads are never
+    # shared between processes
+    if cmd.server == "production":
+        if cmd.use_local_cache and cmd.workers > 1:
+            logging.warning(f"Local cache would diverge across {cmd.workers} workers; using file cache '{cmd.cache_file}' instead")
+            cmd.use_local_cache = False
+            cmd.use_file_cache = True
+
+        def app_factory():
+            worker_config, worker_signer = build_config(cmd)
+            worker_os_client = oci.object_storage.ObjectStorageClient(worker_config, signer=worker_signer)
+            # revalidate in every worker so that rotated credentials reach its own copy of cmd
+            if snapshot is not None and snapshot.needs_revalidation:
+                start_revalidation(cmd, worker_config, worker_signer, worker_os_client, snapshot)
+            app = create_app(cmd, worker_os_client, namespace, snapshot)
+            QRcode(app)
+            return app
+
+        serve(cmd, app_factory)
+    else:
+        app = create_app(cmd, os_client, namespace, snapshot)
+        QRcode(app)
+        app.run(host="0.0.0.0", port=5000)
 
 
 
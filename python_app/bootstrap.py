@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+import oci
+import os
+import json
+import time
+import base64
+import logging
+import tempfile
+import threading
+
+# secrets in the vault compartment that map onto command line arguments
+SECRET_ARGUMENTS = {"username": "username", "password": "password", "bucket": "bucket", "redis-url": "redis_url"}
+
+#
+# read every secret in the vault compartment.  the secret bundles are fetched concurrently
+# instead of one round trip after the other.  returns {secret name: decoded content}
+#
+def load_secrets(config, signer, compartment_id: str, max_workers: int = 8) -> dict:
+    vault_client = oci.vault.VaultsClient(config=config, signer=signer)
+    secret_client = oci.secrets.SecretsClient(config=config, signer=signer)
+
+    secrets_list = vault_client.list_secrets(compartment_id).data
+    if not secrets_list:
+        return {}
+
+    def read(secret):
+        response = secret_client.get_secret_bundle(secret.id)
+        return base64.b64decode(response.data.secret_bundle_content.content.encode('ascii')).decode('ascii')
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(secrets_list)), thread_name_prefix="secrets") as executor:
+        contents = executor.map(read, secrets_list)
+        return {secret.secret_name: content for secret, content in zip(secrets_list, contents)}
+
+# copy the secrets that map onto arguments into cmd
+def apply_secrets(cmd, secret_values: dict):
+    for secret_name, argument in SECRET_ARGUMENTS.items():
+        if secret_name in secret_values:
+            setattr(cmd, argument, secret_values[secret_name])
+
+#
+# Versioned snapshot of everything the app needs before it can serve the first page: the
+# object storage namespace, the vault secrets and the catalog index.  It is written to a local
+# file readable only by the owner (it holds the secrets) so that a restarted container or a
+# newly forked worker starts from the last known state in milliseconds, while the values are
+# revalidated in the background.  The file looks like:
+# {"format": 1, "source": {"secret": ..., "bucket": ...}, "saved": 1712345678.9,
+#  "namespace": "ns", "secrets": {"username": ...}, "catalog": {"version": ..., "built": ..., "catalog": {...}}}
+# A snapshot written for a different secret compartment or bucket argument is ignored.
+#
+class BootSnapshot:
+    FORMAT = 1
+
+    def __init__(self, path: str, source: dict):
+        self.path = path
+        self.source = source
+        self.lock = threading.Lock()
+        self.values = {}
+        # the namespace and secrets were served from disk and are not yet checked against OCI
+        self.needs_revalidation = False
+
+    # read the snapshot from disk.  returns False if there is no usable snapshot
+    def load(self) -> bool:
+        values = self._read()
+        if values is None:
+            return False
+        with self.lock:
+            self.values = values
+        return True
+
+    def get(self, key: str, default=None):
+        with self.lock:
+            return self.values.get(key, default)
+
+    # merge values into the snapshot and write it atomically.  the file is re-read first since
+    # other processes (i.e. production workers) update other parts of it
+    def update(self, **values):
+        with self.lock:
+            self.values = self._read() or self.values
+            self.values.update(values, format=self.FORMAT, source=self.source, saved=time.time())
+            data = json.dumps(self.values, separators=(",", ":"))
+            directory = os.path.dirname(os.path.abspath(self.path))
+            try:
+                fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with os.fdopen(fd, "w") as snapshot_file:
+                    snapshot_file.write(data)
+                os.chmod(temp_path, 0o600)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                logging.error(f"Error writing boot snapshot '{self.path}': " + str(e))
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as snapshot_file:
+                values = json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable boot snapshot '{self.path}': " + str(e))
+            return None
+        if values.get("format") != self.FORMAT or values.get("source") != self.source:
+            logging.info(f"Ignoring boot snapshot '{self.path}' written for another version or configuration")
+            return None
+        return values
+
+#
+# resolve the namespace and secrets, from the snapshot if there is one (and revalidate them in
+# the background) or else by calling OCI, with the namespace and secret lookups in parallel.
+# returns the namespace and applies the secrets to cmd.  with revalidate=False the caller
+# starts the revalidation itself (see start_revalidation), i.e. in each production worker
+# since changes applied in the gunicorn master after the fork never reach the workers
+#
+def bootstrap(cmd, config, signer, os_client, snapshot: BootSnapshot = None, revalidate: bool = True) -> str:
+    if snapshot is not None and snapshot.load() and snapshot.get("namespace"):
+        apply_secrets(cmd, snapshot.get("secrets", {}))
+        logging.info(f"Loaded namespace and secrets from boot snapshot '{snapshot.path}'")
+        snapshot.needs_revalidation = True
+        if revalidate:
+            start_revalidation(cmd, config, signer, os_client, snapshot)
+        return snapshot.get("namespace")
+
+    namespace, secret_values = _fetch(cmd, config, signer, os_client)
+    apply_secrets(cmd, secret_values)
+    if snapshot is not None:
+        snapshot.update(namespace=namespace, secrets=secret_values)
+    return namespace
+
+def _fetch(cmd, config, signer, os_client):
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="bootstrap") as executor:
+        namespace = executor.submit(os_client.get_namespace, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+        secret_values = executor.submit(load_secrets, config, signer, cmd.secret) if cmd.secret else None
+        return namespace.result().data, secret_values.result() if secret_values else {}
+
+def start_revalidation(cmd, config, signer, os_client, snapshot: BootSnapshot):
+    threading.Thread(target=_revalidate, args=(cmd, config, signer, os_client, snapshot), name="boot-revalidate", daemon=True).start()
+
+# refresh the snapshot from OCI.  credentials are applied to cmd of the calling process right
+# away; a changed bucket or redis url is only picked up on the next start
+def _revalidate(cmd, config, signer, os_client, snapshot: BootSnapshot):
+    try:
+        namespace, secret_values = _fetch(cmd, config, signer, os_client)
+    except Exception as e:
+        logging.error("Error revalidating boot snapshot: " + str(e))
+        return
+    if namespace != snapshot.get("namespace") or secret_values != snapshot.get("secrets"):
+        logging.warning("Namespace or secrets changed since the boot snapshot was written; restart to apply bucket or redis changes")
+        for secret_name in ("username", "password"):
+            if secret_name in secret_values:
+                setattr(cmd, SECRET_ARGUMENTS[secret_name], secret_values[secret_name])
+    snapshot.update(namespace=namespace, secrets=secret_values)
@@ -1,4 +1,12 @@
-from redis import Redis
+from redis import Redis, BlockingConnectionPool, Connection, SSLConnection
+import sqlite3
+import secrets
+import json
+import time
+import threading
+from collections import OrderedDict
+from listing import HLS_SUFFIX
+from par import par_scope
 
 #
 # Abstract base class for cache implementations
@@ -7,90 +15,729 @@ class CacheProvider:
     def __str(self, hostname):
         return "Cache provider: " + hostname
 
+    # block until the session is authenticated or timeout seconds pass.  providers that can be
+    # notified override this; the fallback polls once a second
+    def wait_authenticated(self, session_id: str, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while True:
+            if self.get_authenticated(session_id):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(1, remaining))
+
+    #
+    # batched variants of the single key methods.  providers with a remote backend override these
+    # to do the whole batch in one round trip
+    #
+    def set_authenticated_many(self, values: dict):
+        for session_id, value in values.items():
+            self.set_authenticated(session_id, value)
+
+    def get_authenticated_many(self, session_ids: list) -> dict:
+        return {session_id: self.get_authenticated(session_id) for session_id in session_ids}
+
+    def is_session_in_authenticated_many(self, session_ids: list) -> dict:
+        return {session_id: self.is_session_in_authenticated(session_id) for session_id in session_ids}
+
+    def set_shared_many(self, values: dict):
+        for auth_id, value in values.items():
+            self.set_shared(auth_id, value)
+
+    def get_shared_many(self, auth_codes: list) -> dict:
+        return {auth_code: self.get_shared(auth_code) for auth_code in auth_codes}
+
+    def set_value_many(self, values: dict, ttl: int = None):
+        for key, value in values.items():
+            self.set_value(key, value, ttl)
+
+    def get_value_many(self, keys: list) -> dict:
+        return {key: self.get_value(key) for key in keys}
+
+    #
+    # resolve a share code together with the pooled PAR of the shared video so that opening a
+    # share link is a single lookup.  returns (name, PAR entry); either may be None
+    #
+    def get_shared_with_par(self, auth_code: str) -> tuple:
+        name = self.get_shared(auth_code)
+        if name is None:
+            return None, None
+        return name, self.get_value(f"par:{par_scope(name)}")
+
+#
+# Tracks threads waiting on an auth session so they can be woken as soon as it is authenticated
+#
+class AuthWaiters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = {}
+
+    def wait(self, session_id: str, is_authenticated, timeout: float) -> bool:
+        with self.lock:
+            event, waiters = self.events.get(session_id, (threading.Event(), 0))
+            self.events[session_id] = (event, waiters + 1)
+        try:
+            # check after registering so a notification can't slip in between check and wait
+            if is_authenticated(session_id):
+                return True
+            event.wait(timeout)
+            return is_authenticated(session_id)
+        finally:
+            with self.lock:
+                event, waiters = self.events[session_id]
+                if waiters > 1:
+                    self.events[session_id] = (event, waiters - 1)
+                else:
+                    del self.events[session_id]
+
+    def notify(self, session_id: str):
+        with self.lock:
+            entry = self.events.get(session_id)
+        if entry:
+            entry[0].set()
+
+#
+# Bounded in-process LRU cache with per-entry expiry.  Expired entries are dropped when they
+# are read and the least recently used entry is evicted once max_entries is reached.
+#
+class TTLCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set(self, key, value, ttl: float = None):
+        expires = time.time() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # returns default when the key is missing or expired
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] and entry[1] < time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def items(self) -> dict:
+        now = time.time()
+        with self.lock:
+            return {key: value for key, (value, expires) in self.entries.items() if not expires or expires >= now}
+
+_MISSING = object()
+
 #
-# Local cache provider using an in-memory dictionary
+# token bucket arithmetic shared by the providers (the Redis script mirrors it).  a bucket
+# starts with burst tokens and refills at rate tokens per second up to burst.  returns the
+# tokens left and 0 when a token was taken, or the seconds until one will be available
+#
+def _take_token(tokens: float, updated: float, now: float, rate: float, burst: int) -> tuple:
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+# seconds after which an untouched bucket is full again and can be forgotten
+def _bucket_ttl(rate: float, burst: int) -> int:
+    return int(burst / rate) + 1
+
+#
+# Local cache provider using bounded in-memory LRU caches.  Auth sessions and share codes expire
+# with the same ttls as the Redis provider so they don't accumulate with every /login visit
 #
 class LocalCacheProvider(CacheProvider):
-    def __init__(self, hostname):
-        self.authenticated = {}
-        self.shared = {}
+    def __init__(self, hostname, max_entries: int = 10000):
+        self.authenticated = TTLCache(max_entries)
+        self.shared = TTLCache(max_entries)
+        self.values = TTLCache(max_entries)
+        self.buckets = TTLCache(max_entries)
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.waiters = AuthWaiters()
 
     def get_authenticated_dict(self):
-        return self.authenticated
+        return self.authenticated.items()
     
+    # record the auth session id for 15 minutes
     def set_authenticated(self, session_id: str, value: bool):
-        self.authenticated[session_id] = value
+        self.authenticated.set(session_id, value, 60*15)
+        if value:
+            self.waiters.notify(session_id)
+
+    def wait_authenticated(self, session_id: str, timeout: float) -> bool:
+        return self.waiters.wait(session_id, self.get_authenticated, timeout)
 
     def get_authenticated(self, session_id: str) -> bool:
-        try:
-            return self.authenticated[session_id]
-        except: 
-            return False
+        return self.authenticated.get(session_id, False)
     
     def is_session_in_authenticated(self, session_id: str) -> bool:
         return session_id in self.authenticated
     
+    # record the share auth code for 48 hours.  value is the name of the movie
     def set_shared(self, auth_id: str, value: str):
-        self.shared[auth_id] = value
+        self.shared.set(auth_id, value, 60*60*48)
 
+    # return the name of the movie matching the authcode or None
     def get_shared(self, auth_code: str) -> str:
-        try:
-            return self.shared[auth_code]
-        except:
-            return False
+        return self.shared.get(auth_code)
+
+    # store an arbitrary json-serializable value (i.e. the catalog index) with an optional ttl in seconds
+    def set_value(self, key: str, value, ttl: int = None):
+        self.values.set(key, value, ttl)
+
+    def get_value(self, key: str):
+        return self.values.get(key)
+
+    # acquire_lock returns a token (None if the lock is held) that release_lock must be given,
+    # so a holder that overran the ttl can't release the lock someone else has taken since.
+    # there is only one process so the lock is only needed between threads
+    def acquire_lock(self, name: str, ttl: int) -> str:
+        with self.lock:
+            expires, owner = self.locks.get(name, (0, None))
+            if expires > time.time():
+                return None
+            token = secrets.token_hex(8)
+            self.locks[name] = (time.time() + ttl, token)
+            return token
+
+    def release_lock(self, name: str, token: str):
+        with self.lock:
+            if self.locks.get(name, (0, None))[1] == token:
+                del self.locks[name]
+
+    # take a token from the rate limit bucket key.  returns 0 when a token was taken, otherwise
+    # the seconds until one is available
+    def take_token(self, key: str, rate: float, burst: int) -> float:
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens, retry_after = _take_token(tokens, updated, now, rate, burst)
+            self.buckets.set(key, (tokens, now), _bucket_ttl(rate, burst))
+        return retry_after
 
 #
-# Cache provider leveraging OCI Redis Service
+# Cache provider leveraging OCI Redis Service.  All workers threads share one explicitly sized,
+# health-checked connection pool; when every connection is busy callers wait up to
+# socket_timeout seconds for one instead of opening more.  Every method is a single round trip
+# and the *_many variants pipeline a whole batch into one round trip.
 #
 class RedisCacheProvider(CacheProvider):
-    def __init__(self, hostname):
-        self.redis = Redis(host=hostname, port=6379, ssl=True, ssl_cert_reqs="none", decode_responses=True)
+    AUTH_CHANNEL = "auth-events"
+    # get_shared_with_par on the server: the share, then the PAR pooled under par_scope() of
+    # the shared name
+    SHARED_WITH_PAR_SCRIPT = """
+        local name = redis.call('GET', KEYS[1])
+        if not name then
+            return {false, false}
+        end
+        local scope = name
+        if string.find(name, ARGV[1], 1, true) then
+            scope = string.match(name, '^(.*/)')
+        end
+        return {name, redis.call('GET', ARGV[2] .. scope)}
+    """
+    # take_token on the server so every worker and container draws from the same bucket.
+    # same arithmetic as _take_token, using the redis clock
+    TAKE_TOKEN_SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local retry_after = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            retry_after = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+        redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+        return tostring(retry_after)
+    """
+    # release_lock on the server: only the holder's token deletes the lock
+    RELEASE_LOCK_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
 
-    def get_authenticated_dict(self):
+    def __init__(self, hostname, port: int = 6379, max_connections: int = 50, socket_timeout: float = 5, health_check_interval: int = 30, use_ssl: bool = True, ssl_cert_reqs: str = "none", ssl_ca_certs: str = None):
+        connection_kwargs = {
+            "host": hostname,
+            "port": port,
+            "socket_timeout": socket_timeout,
+            "socket_connect_timeout": socket_timeout,
+            "socket_keepalive": True,
+            "health_check_interval": health_check_interval,
+            "retry_on_timeout": True,
+            "decode_responses": True,
+        }
+        connection_class = Connection
+        if use_ssl:
+            connection_class = SSLConnection
+            connection_kwargs.update(ssl_cert_reqs=ssl_cert_reqs, ssl_ca_certs=ssl_ca_certs, ssl_check_hostname=ssl_cert_reqs == "required")
+        self.pool = BlockingConnectionPool(max_connections=max_connections, timeout=socket_timeout, connection_class=connection_class, **connection_kwargs)
+        self.redis = Redis(connection_pool=self.pool)
+        self.shared_with_par = self.redis.register_script(self.SHARED_WITH_PAR_SCRIPT)
+        self.take_token_script = self.redis.register_script(self.TAKE_TOKEN_SCRIPT)
+        self.release_lock_script = self.redis.register_script(self.RELEASE_LOCK_SCRIPT)
+        self.waiters = AuthWaiters()
+        self.listener = None
+        self.listener_lock = threading.Lock()
+
+    # walk the auth keyspace with a cursor instead of KEYS so redis is never blocked, fetching
+    # the values of each batch of keys with a single MGET
+    def get_authenticated_dict(self, batch_size: int = 500):
         cache_contents = {}
-        keys = self.redis.keys("auth:*")
-        for key in keys:
-            value = self.redis.get(key)
-            cache_contents[key] = value
+        batch = []
+        for key in self.redis.scan_iter(match="auth:*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                cache_contents.update(zip(batch, self.redis.mget(batch)))
+                batch = []
+        if batch:
+            cache_contents.update(zip(batch, self.redis.mget(batch)))
         return cache_contents
     
-    # record the auth session id for 15 minutes
+    # record the auth session id for 15 minutes.  waiters in every worker are notified over pub/sub
     def set_authenticated(self, session_id: str, value: bool):
-        self.redis.setex(f"auth:{session_id}", 60*15, str(value))
+        self.set_authenticated_many({session_id: value})
+
+    def set_authenticated_many(self, values: dict):
+        pipeline = self.redis.pipeline(transaction=False)
+        for session_id, value in values.items():
+            pipeline.setex(f"auth:{session_id}", 60*15, str(value))
+            if value:
+                pipeline.publish(self.AUTH_CHANNEL, session_id)
+        pipeline.execute()
+
+    def wait_authenticated(self, session_id: str, timeout: float) -> bool:
+        self._start_listener()
+        return self.waiters.wait(session_id, self.get_authenticated, timeout)
+
+    # one subscriber thread per process wakes up all local waiters
+    def _start_listener(self):
+        with self.listener_lock:
+            if self.listener is None:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**self._channel_handlers())
+                self.listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
 
+    def _channel_handlers(self) -> dict:
+        return {self.AUTH_CHANNEL: lambda message: self.waiters.notify(message["data"])}
+
+    # a missing (expired or unknown) session is not authenticated
     def get_authenticated(self, session_id: str) -> bool:
-        result = self.redis.get(f"auth:{session_id}").lower()
-        if result == "true":
-            return True
-        else:
-            return False
+        result = self.redis.get(f"auth:{session_id}")
+        return result is not None and result.lower() == "true"
+
+    def get_authenticated_many(self, session_ids: list) -> dict:
+        if not session_ids:
+            return {}
+        results = self.redis.mget([f"auth:{session_id}" for session_id in session_ids])
+        return {session_id: result is not None and result.lower() == "true" for session_id, result in zip(session_ids, results)}
     
     def is_session_in_authenticated(self, session_id: str) -> bool:
-        if self.redis.exists(f"auth:{session_id}"):
-            return True
-        else:
-            return False
+        return self.redis.exists(f"auth:{session_id}") > 0
+
+    def is_session_in_authenticated_many(self, session_ids: list) -> dict:
+        pipeline = self.redis.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipeline.exists(f"auth:{session_id}")
+        return {session_id: result > 0 for session_id, result in zip(session_ids, pipeline.execute())}
 
     # record the share auth code for 48 hours.  value is the name of the movie 
     def set_shared(self, auth_id: str, value: str):
         self.redis.setex(f"shared:{auth_id}", 60*60*48, value)
 
+    def set_shared_many(self, values: dict):
+        pipeline = self.redis.pipeline(transaction=False)
+        for auth_id, value in values.items():
+            pipeline.setex(f"shared:{auth_id}", 60*60*48, value)
+        pipeline.execute()
+
+    # return the name of the movie matching the authcode or None
+    def get_shared(self, auth_code: str) -> str:
+        return self.redis.get(f"shared:{auth_code}")
+
+    def get_shared_many(self, auth_codes: list) -> dict:
+        if not auth_codes:
+            return {}
+        return dict(zip(auth_codes, self.redis.mget([f"shared:{auth_code}" for auth_code in auth_codes])))
+
+    def get_shared_with_par(self, auth_code: str) -> tuple:
+        name, entry = self.shared_with_par(keys=[f"shared:{auth_code}"], args=[HLS_SUFFIX, "value:par:"])
+        return name, json.loads(entry) if entry is not None else None
+
+    # store an arbitrary json-serializable value (i.e. the catalog index) with an optional ttl in seconds
+    def set_value(self, key: str, value, ttl: int = None):
+        if ttl:
+            self.redis.setex(f"value:{key}", ttl, json.dumps(value))
+        else:
+            self.redis.set(f"value:{key}", json.dumps(value))
+
+    def get_value(self, key: str):
+        result = self.redis.get(f"value:{key}")
+        if result is None:
+            return None
+        return json.loads(result)
+
+    def set_value_many(self, values: dict, ttl: int = None):
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value in values.items():
+            if ttl:
+                pipeline.setex(f"value:{key}", ttl, json.dumps(value))
+            else:
+                pipeline.set(f"value:{key}", json.dumps(value))
+        pipeline.execute()
+
+    def get_value_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        results = self.redis.mget([f"value:{key}" for key in keys])
+        return {key: json.loads(result) if result is not None else None for key, result in zip(keys, results)}
+
+    # lock shared by all workers/containers using this redis instance.  expires after ttl seconds
+    # so that a crashed worker can't hold it forever
+    def acquire_lock(self, name: str, ttl: int) -> str:
+        token = secrets.token_hex(8)
+        return token if self.redis.set(f"lock:{name}", token, nx=True, ex=ttl) else None
+
+    def release_lock(self, name: str, token: str):
+        self.release_lock_script(keys=[f"lock:{name}"], args=[token])
+
+    # rate limit bucket shared by all workers/containers using this redis instance
+    def take_token(self, key: str, rate: float, burst: int) -> float:
+        return float(self.take_token_script(keys=[f"rate:{key}"], args=[rate, burst, _bucket_ttl(rate, burst)]))
+
+
+#
+# Two tier cache provider: a bounded in-process LRU in front of Redis.  Reads are served from
+# the local tier when possible; misses read the value and its remaining ttl from Redis in one
+# round trip so that local entries never outlive their Redis counterparts (15 minutes for auth
+# sessions, 48 hours for shares).  Every write publishes the key on a pub/sub channel and each
+# worker drops its local copy, keeping workers coherent.  local_ttl bounds how long an entry is
+# trusted locally in case an invalidation is missed while reconnecting.
+#
+class TieredCacheProvider(RedisCacheProvider):
+    INVALIDATE_CHANNEL = "cache-invalidate"
+    # invalidation generations are kept per slot (keys hashed onto slots) so they stay bounded
+    GENERATION_SLOTS = 1024
+
+    def __init__(self, hostname, max_entries: int = 10000, local_ttl: int = 300, **options):
+        super().__init__(hostname, **options)
+        self.local = TTLCache(max_entries)
+        self.local_ttl = local_ttl
+        self.generations = [0] * self.GENERATION_SLOTS
+        self.generation_lock = threading.Lock()
+        self.instance_id = secrets.token_hex(8)
+        self._start_listener()
+
+    def _channel_handlers(self) -> dict:
+        handlers = super()._channel_handlers()
+        handlers[self.AUTH_CHANNEL] = self._on_authenticated
+        handlers[self.INVALIDATE_CHANNEL] = self._on_invalidate
+        return handlers
+
+    # the auth event can arrive before the invalidation of the session, so drop the local copy
+    # first or the woken waiters would read the stale "False" from the local tier
+    def _on_authenticated(self, message):
+        self._invalidate(f"auth:{message['data']}")
+        self.waiters.notify(message["data"])
+
+    # messages are "<instance id> <key>".  our own writes already updated the local tier
+    def _on_invalidate(self, message):
+        instance_id, key = message["data"].split(" ", 1)
+        if instance_id != self.instance_id:
+            self._invalidate(key)
+
+    # drop the local copy and bump the key's generation so that a read from Redis that started
+    # before the invalidation doesn't put the stale value back (see _fill_local)
+    def _invalidate(self, key: str):
+        with self.generation_lock:
+            self.generations[hash(key) % self.GENERATION_SLOTS] += 1
+            self.local.pop(key)
+
+    def _generation(self, key: str) -> int:
+        return self.generations[hash(key) % self.GENERATION_SLOTS]
+
+    # keep a value read from Redis locally unless the key was invalidated since generation
+    def _fill_local(self, key: str, value, pttl: int, generation: int):
+        with self.generation_lock:
+            if self._generation(key) == generation:
+                self._set_local(key, value, pttl / 1000 if pttl > 0 else None)
+
+    def _publish_invalidations(self, keys):
+        pipeline = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipeline.publish(self.INVALIDATE_CHANNEL, f"{self.instance_id} {key}")
+        pipeline.execute()
+
+    # read through the local tier.  misses are not cached locally
+    def _get(self, key: str):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        generation = self._generation(key)
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.get(key)
+        pipeline.pttl(key)
+        value, pttl = pipeline.execute()
+        if value is not None:
+            self._fill_local(key, value, pttl, generation)
+        return value
+
+    def _get_many(self, keys: list) -> dict:
+        results = {}
+        misses = []
+        for key in keys:
+            value = self.local.get(key, _MISSING)
+            if value is _MISSING:
+                misses.append(key)
+            else:
+                results[key] = value
+        if misses:
+            generations = [self._generation(key) for key in misses]
+            pipeline = self.redis.pipeline(transaction=False)
+            for key in misses:
+                pipeline.get(key)
+                pipeline.pttl(key)
+            replies = pipeline.execute()
+            for i, key in enumerate(misses):
+                value, pttl = replies[2*i], replies[2*i + 1]
+                if value is not None:
+                    self._fill_local(key, value, pttl, generations[i])
+                results[key] = value
+        return results
+
+    def _set_local(self, key: str, value, ttl: float = None):
+        self.local.set(key, value, min(ttl, self.local_ttl) if ttl else self.local_ttl)
+
+    def set_authenticated_many(self, values: dict):
+        super().set_authenticated_many(values)
+        for session_id, value in values.items():
+            self._set_local(f"auth:{session_id}", str(value), 60*15)
+        self._publish_invalidations([f"auth:{session_id}" for session_id in values])
+
+    def get_authenticated(self, session_id: str) -> bool:
+        result = self._get(f"auth:{session_id}")
+        return result is not None and result.lower() == "true"
+
+    def get_authenticated_many(self, session_ids: list) -> dict:
+        results = self._get_many([f"auth:{session_id}" for session_id in session_ids])
+        return {session_id: results[f"auth:{session_id}"] is not None and results[f"auth:{session_id}"].lower() == "true" for session_id in session_ids}
+
+    def is_session_in_authenticated(self, session_id: str) -> bool:
+        return self._get(f"auth:{session_id}") is not None
+
+    def set_shared(self, auth_id: str, value: str):
+        self.set_shared_many({auth_id: value})
+
+    def set_shared_many(self, values: dict):
+        super().set_shared_many(values)
+        for auth_id, value in values.items():
+            self._set_local(f"shared:{auth_id}", value, 60*60*48)
+        self._publish_invalidations([f"shared:{auth_id}" for auth_id in values])
+
+    def get_shared(self, auth_code: str) -> str:
+        return self._get(f"shared:{auth_code}")
+
+    def get_shared_many(self, auth_codes: list) -> dict:
+        results = self._get_many([f"shared:{auth_code}" for auth_code in auth_codes])
+        return {auth_code: results[f"shared:{auth_code}"] for auth_code in auth_codes}
+
+    # both lookups are normally served by the local tier, so skip the server side script
+    get_shared_with_par = CacheProvider.get_shared_with_par
+
+    # values are kept locally as their json text and decoded on every read so that callers can't
+    # mutate the shared copy
+    def set_value(self, key: str, value, ttl: int = None):
+        self.set_value_many({key: value}, ttl)
+
+    def set_value_many(self, values: dict, ttl: int = None):
+        super().set_value_many(values, ttl)
+        for key, value in values.items():
+            self._set_local(f"value:{key}", json.dumps(value), ttl)
+        self._publish_invalidations([f"value:{key}" for key in values])
+
+    def get_value(self, key: str):
+        result = self._get(f"value:{key}")
+        if result is None:
+            return None
+        return json.loads(result)
+
+    def get_value_many(self, keys: list) -> dict:
+        results = self._get_many([f"value:{key}" for key in keys])
+        return {key: json.loads(results[f"value:{key}"]) if results[f"value:{key}"] is not None else None for key in keys}
+
+#
+# Cache provider backed by a sqlite file so that multiple worker processes on the same host
+# share one cache.  Used in production mode when the local cache is requested with more than
+# one worker.  Entries expire with the same ttls as the Redis provider.  Expired rows are also
+# purged on a write at most every PURGE_INTERVAL seconds, since most of them (i.e. the auth
+# session of a login page that was closed) are never read again.
+#
+class FileCacheProvider(CacheProvider):
+    PURGE_INTERVAL = 60
+
+    def __init__(self, hostname):
+        self.path = hostname
+        self.local = threading.local()
+        self.purged = 0
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+
+    # sqlite connections can't be shared between threads so each thread opens its own
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def _set(self, key: str, value: str, ttl: int = None):
+        expires = time.time() + ttl if ttl else None
+        self._connection().execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+        self._purge_expired()
+
+    # write a batch in one transaction
+    def _set_many(self, values: dict, ttl: int = None):
+        expires = time.time() + ttl if ttl else None
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", [(key, value, expires) for key, value in values.items()])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._purge_expired()
+
+    # delete every expired row, at most once per PURGE_INTERVAL in each process
+    def _purge_expired(self):
+        now = time.time()
+        if now - self.purged < self.PURGE_INTERVAL:
+            return
+        self.purged = now
+        self._connection().execute("DELETE FROM cache WHERE expires < ?", (now,))
+
+    def _get(self, key: str):
+        row = self._connection().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] and row[1] < time.time():
+            self._connection().execute("DELETE FROM cache WHERE key = ? AND expires < ?", (key, time.time()))
+            return None
+        return row[0]
+
+    def get_authenticated_dict(self):
+        rows = self._connection().execute("SELECT key, value FROM cache WHERE key LIKE 'auth:%' AND (expires IS NULL OR expires >= ?)", (time.time(),)).fetchall()
+        return {key: value for key, value in rows}
+
+    # record the auth session id for 15 minutes
+    def set_authenticated(self, session_id: str, value: bool):
+        self._set(f"auth:{session_id}", str(value), 60*15)
+
+    def get_authenticated(self, session_id: str) -> bool:
+        result = self._get(f"auth:{session_id}")
+        return result is not None and result.lower() == "true"
+
+    def is_session_in_authenticated(self, session_id: str) -> bool:
+        return self._get(f"auth:{session_id}") is not None
+
+    # record the share auth code for 48 hours.  value is the name of the movie
+    def set_shared(self, auth_id: str, value: str):
+        self._set(f"shared:{auth_id}", value, 60*60*48)
+
+    def set_shared_many(self, values: dict):
+        self._set_many({f"shared:{auth_id}": value for auth_id, value in values.items()}, 60*60*48)
+
     # return the name of the movie matching the authcode
     def get_shared(self, auth_code: str) -> str:
-        if self.redis.exists(f"shared:{auth_code}") == False:
+        return self._get(f"shared:{auth_code}")
+
+    def set_value(self, key: str, value, ttl: int = None):
+        self._set(f"value:{key}", json.dumps(value), ttl)
+
+    def get_value(self, key: str):
+        result = self._get(f"value:{key}")
+        if result is None:
             return None
-        return self.redis.get(f"shared:{auth_code}")
+        return json.loads(result)
 
+    # the write transaction serializes lock attempts across processes
+    def acquire_lock(self, name: str, ttl: int) -> str:
+        token = secrets.token_hex(8)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM cache WHERE key = ? AND expires < ?", (f"lock:{name}", time.time()))
+            cursor = connection.execute("INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)", (f"lock:{name}", token, time.time() + ttl))
+            acquired = cursor.rowcount == 1
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return token if acquired else None
+
+    def release_lock(self, name: str, token: str):
+        self._connection().execute("DELETE FROM cache WHERE key = ? AND value = ?", (f"lock:{name}", token))
+
+    # the write transaction serializes updates of the bucket across processes
+    def take_token(self, key: str, rate: float, burst: int) -> float:
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires >= ?)", (f"rate:{key}", now)).fetchone()
+            tokens, updated = json.loads(row[0]) if row else (burst, now)
+            tokens, retry_after = _take_token(tokens, updated, now, rate, burst)
+            connection.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (f"rate:{key}", json.dumps([tokens, now]), now + _bucket_ttl(rate, burst)))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._purge_expired()
+        return retry_after
 
 #
 # Factory to return appropriate cache based on input type
 #
 class CacheProviderFactory:
     @staticmethod
-    def get_cache_provider(provider_type, hostname):
+    def get_cache_provider(provider_type, hostname, **options):
         if provider_type == 'local':
-            return LocalCacheProvider(hostname)
+            return LocalCacheProvider(hostname, **options)
         elif provider_type == 'cloud':
-            return RedisCacheProvider(hostname)
+            return RedisCacheProvider(hostname, **options)
+        elif provider_type == 'tiered':
+            return TieredCacheProvider(hostname, **options)
+        elif provider_type == 'file':
+            return FileCacheProvider(hostname)
         else:
-            raise ValueError("Invalid cache provider type: must be local or cloud")
\ No newline at end of file
+            raise ValueError("Invalid cache provider type: must be local, cloud, tiered or file")
\ No newline at end of file
@@ -0,0 +1,374 @@
+from listing import BucketLister, HLS_SUFFIX, HLS_PLAYLIST
+from search import SearchIndex
+from hls import RENDITION_HEIGHT
+from shared import SharedIndex
+import time
+import logging
+import threading
+
+#
+# A single playable title.  For HLS titles name is the path of the output.m3u8 playlist
+#
+class Video:
+    __slots__ = ("name", "display_name", "folder", "is_hls", "size", "etag", "time_created", "time_modified")
+
+    def __init__(self, name: str, display_name: str, folder: str, is_hls: bool, size: int = None, etag: str = None, time_created: str = None, time_modified: str = None):
+        self.name = name
+        self.display_name = display_name
+        self.folder = folder
+        self.is_hls = is_hls
+        self.size = size
+        self.etag = etag
+        self.time_created = time_created
+        self.time_modified = time_modified
+
+    # HLS playlists live in the *.hls/ folder; segments are resolved relative to it
+    @property
+    def prefix(self) -> str:
+        return self.name.rsplit("/", 1)[0] + "/"
+
+    # renditions of one title are HLS folders named title.label.hls where label is a height
+    # (i.e. 2022.1080p.hls).  any other dots are part of the title (Mom.Birthday.hls)
+    @property
+    def title(self) -> str:
+        title, label = self._split_label()
+        return title
+
+    # the rendition label (i.e. 1080p), or None when the folder is not named title.label.hls
+    @property
+    def label(self):
+        title, label = self._split_label()
+        return label
+
+    def _split_label(self) -> tuple:
+        title, dot, label = self.display_name.rpartition(".")
+        if dot and title and RENDITION_HEIGHT.match(label):
+            return title, label
+        return self.display_name, None
+
+    #
+    # parse an object name of the form folder/title.mp4 or folder/title.hls/output.m3u8.
+    # returns None for folders, root level objects and HLS segments
+    #
+    @staticmethod
+    def parse(object_name: str):
+        split_str = object_name.split("/", 1)
+        if len(split_str) < 2 or len(split_str[1]) < 1:
+            return None
+        folder, name = split_str
+
+        if HLS_SUFFIX in name:
+            if name.rsplit("/", 1)[1] != HLS_PLAYLIST:
+                return None
+            display_name = name.rsplit("/", 1)[0].rsplit(".", 1)[0]
+            return Video(object_name, display_name, folder, True)
+
+        return Video(object_name, name.rsplit(".", 1)[0], folder, False)
+
+    @staticmethod
+    def from_object(object_file):
+        video = Video.parse(object_file.name)
+        if video is not None:
+            video.size = object_file.size
+            video.etag = object_file.etag
+            video.time_created = object_file.time_created.isoformat() if object_file.time_created else None
+            video.time_modified = object_file.time_modified.isoformat() if object_file.time_modified else None
+        return video
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @staticmethod
+    def from_dict(values: dict):
+        return Video(**values)
+
+#
+# Indexed catalog of every title in the bucket:
+#   folders: folder name -> list of videos in name order (the navigation tabs)
+#   by_name: object name -> video
+#   by_title: display name -> list of videos sharing that title (i.e. mp4 and HLS versions)
+#   renditions: folder/title -> HLS videos that are renditions of the same title
+# plus a search index over the display names that is built the first time it is needed
+#
+class Catalog:
+    def __init__(self):
+        self.folders = {}
+        self.by_name = {}
+        self.by_title = {}
+        self.renditions = {}
+        self._search_index = None
+
+    def __len__(self):
+        return len(self.by_name)
+
+    # add an object summary from the bucket listing (or a video carried over from a previous
+    # listing).  returns the video or None if not playable
+    def add(self, object_file):
+        video = object_file if isinstance(object_file, Video) else Video.from_object(object_file)
+        if video is not None:
+            self.add_video(video)
+        return video
+
+    def add_video(self, video: Video):
+        if video.name in self.by_name:
+            return
+        self.folders.setdefault(video.folder, []).append(video)
+        self.by_name[video.name] = video
+        self.by_title.setdefault(video.display_name, []).append(video)
+        if video.is_hls:
+            self.renditions.setdefault(f"{video.folder}/{video.title}", []).append(video)
+
+    # catalogs are not modified once built, so the index stays valid for the catalog's lifetime
+    @property
+    def search_index(self) -> SearchIndex:
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.by_name.values())
+        return self._search_index
+
+    def sections(self) -> list:
+        return list(self.folders.keys())
+
+    def videos(self, folder: str) -> list:
+        return self.folders.get(folder, [])
+
+    def lookup(self, name: str):
+        return self.by_name.get(name)
+
+    def find_title(self, display_name: str) -> list:
+        return self.by_title.get(display_name, [])
+
+    def find_renditions(self, video: Video) -> list:
+        return self.renditions.get(f"{video.folder}/{video.title}", [video])
+
+    # copy of the catalog with videos added or replaced and the named videos removed.  catalogs
+    # are never modified in place since request threads read them without locking
+    def with_changes(self, videos: list = (), removed: list = ()):
+        changed = {video.name: video for video in videos}
+        removed = set(removed)
+        merged = [video for video in self.by_name.values() if video.name not in changed and video.name not in removed]
+        merged.extend(changed.values())
+        merged.sort(key=lambda video: video.name)
+        catalog = Catalog()
+        for video in merged:
+            catalog.add_video(video)
+        return catalog
+
+    #
+    # per folder differences from an older catalog:
+    # {"Movies": {"added": [...], "removed": [...], "changed": [...]}} with object names
+    #
+    def diff(self, older) -> dict:
+        changes = {}
+        for folder in set(self.folders) | set(older.folders):
+            names = {video.name: video.etag for video in self.videos(folder)}
+            old_names = {video.name: video.etag for video in older.videos(folder)}
+            folder_changes = {
+                "added": sorted(names.keys() - old_names.keys()),
+                "removed": sorted(old_names.keys() - names.keys()),
+                "changed": sorted(name for name in names.keys() & old_names.keys() if names[name] != old_names[name]),
+            }
+            if any(folder_changes.values()):
+                changes[folder] = folder_changes
+        return changes
+
+    def to_dict(self) -> dict:
+        return {"videos": [video.to_dict() for videos in self.folders.values() for video in videos]}
+
+    @staticmethod
+    def from_dict(values: dict):
+        catalog = Catalog()
+        for video in values["videos"]:
+            catalog.add_video(Video.from_dict(video))
+        return catalog
+
+#
+# Catalog index shared by all workers through the cache provider.  The index is built once at
+# startup and refreshed by a background thread every ttl seconds so that page renders never
+# have to list the bucket.  Refreshes are incremental: folders are still listed, but HLS
+# folders already in the index are not resolved again, and the new listing is diffed against
+# the index per folder so that only real changes are published.  Every full_refresh seconds
+# the HLS playlists are resolved again to pick up re-encoded titles.  Object storage events
+# posted to the app (apply_event) patch single titles in between refreshes.
+#
+# The shared copy lives under two keys (see SharedIndex) so that workers can cheaply poll for
+# changes:
+# catalog:meta = {"built": 1712345678.9, "version": 1712345600.1, "full": 1712300000.0}
+# catalog:index = {"version": 1712345600.1, "catalog": {"videos": [{name=foo1, ...}, ...]}}
+# built is the last time the bucket was checked, version the last time the catalog changed.
+# With a boot snapshot the last catalog is also kept on local disk so that a new process can
+# serve pages straight away and do its first refresh in the background.
+#
+class CatalogIndex(SharedIndex):
+    CACHE_KEY = "catalog:index"
+    META_KEY = "catalog:meta"
+    LOCK_NAME = "catalog:refresh"
+    FIELD = "catalog"
+    NAME = "catalog"
+    # how often workers check the shared copy for changes made by other workers
+    POLL_INTERVAL = 5
+    # how long start() waits for the first catalog (built here or by another worker) before the
+    # worker serves an empty catalog and the refresh thread carries on.  must stay well below
+    # the gunicorn worker timeout in server.py since it runs while the worker boots
+    STARTUP_WAIT = 30
+    STARTUP_POLL = 0.5
+
+    def __init__(self, cmd, os_client, namespace, cache, ttl: int, full_refresh: int = 60*60*24, snapshot=None):
+        super().__init__(cache)
+        self.cmd = cmd
+        self.os_client = os_client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.full_refresh = full_refresh
+        self.catalog = Catalog()
+        self.built = 0
+        self.full = 0
+        # set once the index holds a built catalog
+        self.ready = threading.Event()
+        self.snapshot = snapshot
+        self.lister = BucketLister(os_client, namespace, cmd.bucket, cmd.list_workers)
+
+    #
+    # load (or build) the index before serving the first request and start the refresh thread.
+    # when the boot snapshot has a catalog it is served right away and the first refresh
+    # happens in the background.  otherwise the first refresh (or, when another worker holds
+    # the refresh lock, the wait for its result) runs on the refresh thread and start() waits
+    # at most STARTUP_WAIT seconds for it
+    #
+    def start(self):
+        seeded = self._load_snapshot()
+        self.start_polling(0)
+        if not seeded and not self.ready.wait(self.STARTUP_WAIT):
+            logging.warning(f"Catalog index not built within {self.STARTUP_WAIT}s; serving an empty catalog until it is")
+
+    # return the in-process copy of the index.  never touches object storage
+    def get_catalog(self) -> Catalog:
+        return self.catalog
+
+    #
+    # adopt the shared copy if it changed, then relist the bucket if it is due.  only one worker
+    # relists at a time; the others pick up its result from the cache on their next poll
+    #
+    def refresh(self, force: bool = False):
+        self.sync()
+
+        if not force and self.built and time.time() - self.built < self.ttl:
+            return
+
+        token = self.cache.acquire_lock(self.LOCK_NAME, max(self.ttl, 60))
+        if not token:
+            logging.debug("Catalog refresh already in progress in another worker")
+            return
+
+        try:
+            started = time.time()
+            full = force or not self.version or started - self.full >= self.full_refresh
+            catalog = self._list_bucket(full)
+            with self.lock:
+                changes = catalog.diff(self.catalog)
+                self.built = started
+                if full:
+                    self.full = started
+                if changes:
+                    self.catalog = catalog
+                    self.publish(catalog.to_dict(), started)
+                else:
+                    self.publish_meta()
+            self.ready.set()
+            if changes:
+                self._save_snapshot()
+            for folder, folder_changes in changes.items():
+                logging.info(f"Catalog folder '{folder}': {len(folder_changes['added'])} added, {len(folder_changes['removed'])} removed, {len(folder_changes['changed'])} changed")
+            logging.info(f"Catalog index {'fully ' if full else ''}refreshed in {time.time() - started:.2f}s")
+        finally:
+            self.cache.release_lock(self.LOCK_NAME, token)
+
+    # adopt the shared copy if another worker changed it
+    def sync(self):
+        meta = super().sync()
+        if not meta:
+            return
+        self.built = max(self.built, meta["built"])
+        self.full = max(self.full, meta.get("full", 0))
+        self.ready.set()
+
+    # callers hold self.lock
+    def adopt(self, value: dict):
+        self.catalog = Catalog.from_dict(value)
+
+    def meta_fields(self) -> dict:
+        return {"built": self.built, "full": self.full}
+
+    #
+    # apply an object storage event (create, update or delete of one object) to the index and
+    # share it with the other workers.  events for objects that are not playable (i.e. HLS
+    # segments) are ignored.  returns True if the catalog changed
+    #
+    def apply_event(self, event_type: str, object_name: str) -> bool:
+        video = Video.parse(object_name)
+        if video is None:
+            return False
+
+        object_file = None
+        if not event_type.endswith("deleteobject"):
+            object_file = self.lister.head(object_name)
+
+        self.sync()
+        with self.lock:
+            if object_file is not None:
+                video = Video.from_object(object_file)
+                existing = self.catalog.lookup(object_name)
+                if existing is not None and existing.etag == video.etag:
+                    return False
+                catalog = self.catalog.with_changes(videos=[video])
+            elif self.catalog.lookup(object_name) is not None:
+                catalog = self.catalog.with_changes(removed=[object_name])
+            else:
+                return False
+            self.catalog = catalog
+            self.publish(catalog.to_dict(), time.time())
+        self._save_snapshot()
+        logging.info(f"Catalog updated for {event_type} of '{object_name}'")
+        return True
+
+    # adopt the catalog of the boot snapshot.  returns False if there is none
+    def _load_snapshot(self) -> bool:
+        if self.snapshot is None:
+            return False
+        self.snapshot.load()
+        saved = self.snapshot.get("catalog")
+        if not saved:
+            return False
+        with self.lock:
+            self.catalog = Catalog.from_dict(saved["catalog"])
+            self.version = saved["version"]
+            self.built = saved["built"]
+            self.full = saved["full"]
+        logging.info(f"Loaded catalog index with {len(self.catalog)} videos from boot snapshot")
+        return True
+
+    def _save_snapshot(self):
+        if self.snapshot is None:
+            return
+        with self.lock:
+            saved = {"version": self.version, "built": self.built, "full": self.full, "catalog": self.catalog.to_dict()}
+        self.snapshot.update(catalog=saved)
+
+    # poll the shared copy every few seconds and relist when the ttl is up.  until a catalog was
+    # built (here or by the worker holding the refresh lock) the shared copy is polled faster
+    def poll_wait(self) -> float:
+        if not self.built:
+            return self.STARTUP_POLL
+        return max(1, min(self.ttl / 4, self.POLL_INTERVAL))
+
+    # list the bucket, reusing the HLS titles of the current index unless this is a full refresh
+    def _list_bucket(self, full: bool) -> Catalog:
+        known_hls = {}
+        if not full:
+            known_hls = {video.prefix: video for video in self.catalog.by_name.values() if video.is_hls}
+        catalog = Catalog()
+        for object_file in self.lister.list_objects(known_hls):
+            try:
+                catalog.add(object_file)
+            except Exception as e:
+                logging.error("Catalog add error: " + str(e))
+        return catalog
@@ -0,0 +1,118 @@
+from singleflight import SingleFlight
+import oci
+import re
+import logging
+
+URI_ATTRIBUTE = re.compile(r'URI="([^"]+)"')
+RENDITION_HEIGHT = re.compile(r"(\d{3,4})p$")
+
+# fallback bandwidth for renditions without a recognizable label; matches the 8 Mbps target of
+# the sample ffmpeg command in the README
+DEFAULT_BANDWIDTH = 8000000
+BANDWIDTH_BY_HEIGHT = {2160: 16000000, 1440: 10000000, 1080: 6000000, 720: 3000000, 480: 1500000, 360: 800000}
+
+#
+# parse an m3u8 playlist into a json-serializable dict so it can be kept in the cache:
+# {"lines": [...], "segments": [{"uri": "output000.ts", "duration": 4.0}, ...],
+#  "variants": [{"uri": "1080p.m3u8", "attributes": "BANDWIDTH=..."}], "duration": 5400.0}
+#
+def parse_playlist(text: str) -> dict:
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    segments = []
+    variants = []
+    duration = None
+    stream_inf = None
+    for line in lines:
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            stream_inf = line[len("#EXT-X-STREAM-INF:"):]
+        elif not line.startswith("#"):
+            if stream_inf is not None:
+                variants.append({"uri": line, "attributes": stream_inf})
+            else:
+                segments.append({"uri": line, "duration": duration})
+            duration = None
+            stream_inf = None
+    return {
+        "lines": lines,
+        "segments": segments,
+        "variants": variants,
+        "duration": sum(segment["duration"] or 0 for segment in segments),
+    }
+
+#
+# render a parsed playlist with every relative uri (segments and URI="..." attributes such as
+# EXT-X-MAP and EXT-X-KEY) passed through resolve
+#
+def render_playlist(playlist: dict, resolve) -> str:
+    output = []
+    for line in playlist["lines"]:
+        if line.startswith("#"):
+            line = URI_ATTRIBUTE.sub(lambda match: f'URI="{_resolve(match.group(1), resolve)}"', line)
+        else:
+            line = _resolve(line, resolve)
+        output.append(line)
+    return "\n".join(output) + "\n"
+
+def _resolve(uri: str, resolve) -> str:
+    if "://" in uri or uri.startswith("/"):
+        return uri
+    return resolve(uri)
+
+#
+# render a master playlist over several renditions of one title.  renditions are
+# (uri, label) tuples where label is the part of the folder name before .hls (i.e. 2022.1080p)
+#
+def render_master_playlist(renditions: list) -> str:
+    output = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for uri, label in renditions:
+        attributes = f"BANDWIDTH={DEFAULT_BANDWIDTH}"
+        match = RENDITION_HEIGHT.search(label)
+        if match:
+            height = int(match.group(1))
+            width = (height * 16 // 9) // 2 * 2
+            attributes = f"BANDWIDTH={BANDWIDTH_BY_HEIGHT.get(height, DEFAULT_BANDWIDTH)},RESOLUTION={width}x{height}"
+        output.append("#EXT-X-STREAM-INF:" + attributes)
+        output.append(uri)
+    return "\n".join(output) + "\n"
+
+#
+# Fetches HLS playlists from object storage once, keeps the parsed playlist in the cache and
+# rewrites segment uris against the title's pooled PAR.  The PAR is scoped to the *.hls/ folder
+# so one PAR serves every segment of the title for every viewer.
+#
+class PlaylistProxy:
+    CACHE_TTL = 60*60*24
+
+    def __init__(self, cmd, os_client, namespace, cache, par_manager):
+        self.cmd = cmd
+        self.os_client = os_client
+        self.namespace = namespace
+        self.cache = cache
+        self.par_manager = par_manager
+        self.flights = SingleFlight()
+
+    # return the parsed playlist of an HLS video, refetching it if the object changed
+    def get_playlist(self, video) -> dict:
+        entry = self.cache.get_value(f"playlist:{video.name}")
+        if entry and (video.etag is None or entry["etag"] == video.etag):
+            return entry["playlist"]
+        # viewers opening the same title at once share one download
+        return self.flights.do(video.name, lambda: self._fetch_playlist(video))
+
+    def _fetch_playlist(self, video) -> dict:
+        response = self.os_client.get_object(self.namespace, self.cmd.bucket, video.name, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+        playlist = parse_playlist(response.data.content.decode("utf-8"))
+        self.cache.set_value(f"playlist:{video.name}", {"etag": video.etag, "playlist": playlist}, ttl=self.CACHE_TTL)
+        logging.debug("Cached playlist for '%s' with %d segments", video.name, len(playlist["segments"]))
+        return playlist
+
+    # the playlist with segment uris pointing at object storage through the folder's PAR, or at
+    # segment_url(object name) when segments are served some other way
+    def render(self, video, segment_url=None) -> str:
+        playlist = self.get_playlist(video)
+        if segment_url is not None:
+            return render_playlist(playlist, lambda uri: segment_url(video.prefix + uri))
+        base_url = self.cmd.os_endpoint + self.par_manager.get_access_uri(video) + video.prefix
+        return render_playlist(playlist, lambda uri: base_url + uri)
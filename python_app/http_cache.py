@@ -0,0 +1,58 @@
+import os
+import gzip
+import hashlib
+
+# brotli is optional; responses are gzipped when it is not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# responses smaller than this are sent as is since compressing them saves next to nothing
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "application/json", "application/javascript", "application/vnd.apple.mpegurl")
+# versioned static urls never change content, so browsers can keep them for a year
+STATIC_MAX_AGE = 60*60*24*365
+
+#
+# build an entity tag from the values a response depends on
+#
+def make_etag(*parts) -> str:
+    return hashlib.sha1("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+#
+# digest of every file under a directory, used to version templates and static files so that
+# etags and static urls change on deploy.  the same across workers and containers of a release
+#
+def directory_digest(directory: str) -> str:
+    digest = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(directory)):
+        dirs.sort()
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            digest.update(os.path.relpath(path, directory).encode("utf-8"))
+            with open(path, "rb") as content:
+                digest.update(content.read())
+    return digest.hexdigest()[:12]
+
+#
+# compress a buffered response with brotli or gzip if the client accepts it.  streamed
+# responses (video, server-sent events) and responses that are already encoded are left alone
+#
+def compress_response(response, accept_encodings):
+    response.vary.add("Accept-Encoding")
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+        return response
+    if "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+    if brotli is not None and accept_encodings["br"]:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers["Content-Encoding"] = "br"
+    elif accept_encodings["gzip"]:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
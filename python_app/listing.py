@@ -0,0 +1,114 @@
+import oci
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+HLS_SUFFIX = ".hls/"
+HLS_PLAYLIST = "output.m3u8"
+LIST_FIELDS = "size,etag,timeCreated,timeModified,storageTier"
+
+#
+# Prefix-aware lister for the movie bucket.  Rather than listing every object in the bucket
+# (which includes every HLS segment) the bucket is walked one level at a time with a '/'
+# delimiter:
+#   1. list the top level folders
+#   2. list the children of each folder in parallel, descending into sub-folders other than
+#      *.hls/ ones (i.e. Years/sub/clip.mp4)
+#   3. resolve each *.hls/ sub-folder with a single head of its output.m3u8 playlist
+# so the number of calls scales with the number of titles and folders instead of the number of
+# segments
+#
+class BucketLister:
+    def __init__(self, os_client, namespace, bucket, max_workers: int = 8):
+        self.os_client = os_client
+        self.namespace = namespace
+        self.bucket = bucket
+        self.max_workers = max(1, max_workers)
+
+    #
+    # return object summaries for every playable object in the bucket, grouped by folder in name
+    # order.  known_hls maps HLS folder prefixes seen by a previous listing to the entry to return
+    # for them, which skips the head of their playlist
+    #
+    def list_objects(self, known_hls: dict = None) -> list:
+        known_hls = known_hls or {}
+        folders = self.list_folders()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bucket-lister") as executor:
+            listings = list(executor.map(self.list_tree, folders))
+
+            hls_prefixes = []
+            for _, prefixes in listings:
+                hls_prefixes.extend(prefix for prefix in prefixes if prefix.endswith(HLS_SUFFIX) and prefix not in known_hls)
+            playlists = dict(zip(hls_prefixes, executor.map(self.resolve_hls, hls_prefixes)))
+            playlists.update((prefix, known) for prefix, known in known_hls.items() if known is not None)
+
+        results = []
+        for objects, prefixes in listings:
+            folder_objects = list(objects)
+            for prefix in prefixes:
+                playlist = playlists.get(prefix)
+                if playlist is not None:
+                    folder_objects.append(playlist)
+            folder_objects.sort(key=lambda object_file: object_file.name)
+            results.extend(folder_objects)
+        return results
+
+    # top level folders are the navigation tabs.  objects at the root of the bucket are ignored
+    def list_folders(self) -> list:
+        _, prefixes = self.list_prefix("")
+        return prefixes
+
+    # list every object under a folder without listing the inside of HLS folders, returning
+    # (objects, *.hls/ prefixes)
+    def list_tree(self, prefix: str):
+        objects, prefixes = self.list_prefix(prefix)
+        hls_prefixes = []
+        for sub_prefix in prefixes:
+            if sub_prefix.endswith(HLS_SUFFIX):
+                hls_prefixes.append(sub_prefix)
+            else:
+                sub_objects, sub_hls_prefixes = self.list_tree(sub_prefix)
+                objects.extend(sub_objects)
+                hls_prefixes.extend(sub_hls_prefixes)
+        return objects, hls_prefixes
+
+    # list the direct children of a prefix, returning (objects, sub-folder prefixes)
+    def list_prefix(self, prefix: str):
+        objects = []
+        prefixes = []
+        next_starts_with = None
+        while True:
+            response = self.os_client.list_objects(self.namespace, self.bucket, start=next_starts_with, prefix=prefix, delimiter="/", fields=LIST_FIELDS, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+            objects.extend(object_file for object_file in response.data.objects if object_file.name != prefix)
+            prefixes.extend(response.data.prefixes or [])
+            next_starts_with = response.data.next_start_with
+            if not next_starts_with:
+                break
+        return objects, prefixes
+
+    # look up the playlist of an HLS folder directly.  returns None if the folder has no playlist
+    def resolve_hls(self, prefix: str):
+        object_file = self.head(prefix + HLS_PLAYLIST)
+        if object_file is None:
+            logging.warning(f"HLS folder '{prefix}' has no {HLS_PLAYLIST}; skipping")
+        return object_file
+
+    # object summary of a single object from its headers.  returns None if it does not exist
+    def head(self, object_name: str):
+        try:
+            response = self.os_client.head_object(self.namespace, self.bucket, object_name, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+        except oci.exceptions.ServiceError as e:
+            if e.status == 404:
+                return None
+            raise
+
+        headers = response.headers
+        time_modified = None
+        if headers.get("last-modified"):
+            time_modified = parsedate_to_datetime(headers.get("last-modified"))
+        return oci.object_storage.models.ObjectSummary(
+            name=object_name,
+            size=int(headers.get("content-length", 0)),
+            etag=headers.get("etag"),
+            time_created=time_modified,
+            time_modified=time_modified)
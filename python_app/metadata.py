@@ -0,0 +1,279 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from catalog import Video
+from hls import RENDITION_HEIGHT
+from shared import SharedIndex
+import multiprocessing
+import subprocess
+import logging
+import base64
+import shutil
+import json
+import time
+import re
+
+# seconds into a title the poster frame is taken from, and the poster width in pixels
+POSTER_OFFSET = 10
+POSTER_WIDTH = 320
+# longest a single ffprobe or ffmpeg run may take
+TOOL_TIMEOUT = 120
+VARIANT_RESOLUTION = re.compile(r"RESOLUTION=(\d+)x(\d+)")
+
+#
+# Runs in the process pool.  Probes the title at job["url"] (a PAR url, so ffprobe and ffmpeg
+# read only the ranges they need straight from object storage) for its duration and resolution
+# and grabs a poster frame.  Values already known from the playlist are kept.  Returns the
+# metadata entry and the jpeg poster (or None).
+#
+def extract(job: dict) -> tuple:
+    entry = dict(job["known"])
+    poster = None
+    if job.get("url") and job.get("ffprobe"):
+        try:
+            probed = probe(job["ffprobe"], job["url"])
+            for key, value in probed.items():
+                entry.setdefault(key, value)
+        except Exception as e:
+            logging.warning("Unable to probe '%s': %s", job["name"], e)
+    if job.get("url") and job.get("ffmpeg"):
+        try:
+            poster = grab_poster(job["ffmpeg"], job["url"], job.get("offset", 0))
+        except Exception as e:
+            logging.warning("Unable to grab a poster for '%s': %s", job["name"], e)
+    return entry, poster
+
+def probe(ffprobe: str, url: str) -> dict:
+    output = subprocess.run([ffprobe, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height:format=duration", "-of", "json", url],
+                            capture_output=True, check=True, timeout=TOOL_TIMEOUT).stdout
+    probed = json.loads(output)
+    entry = {}
+    streams = probed.get("streams") or [{}]
+    if streams[0].get("width"):
+        entry["width"] = int(streams[0]["width"])
+        entry["height"] = int(streams[0]["height"])
+    if probed.get("format", {}).get("duration"):
+        entry["duration"] = round(float(probed["format"]["duration"]), 1)
+    return entry
+
+def grab_poster(ffmpeg: str, url: str, offset: float) -> bytes:
+    output = subprocess.run([ffmpeg, "-v", "error", "-ss", str(offset), "-i", url, "-frames:v", "1", "-vf", f"scale={POSTER_WIDTH}:-2", "-q:v", "6", "-f", "image2", "-c:v", "mjpeg", "pipe:1"],
+                            capture_output=True, check=True, timeout=TOOL_TIMEOUT).stdout
+    return output or None
+
+# (width, height) of a variant of a master playlist from its RESOLUTION attribute, or None
+def variant_resolution(variant: dict):
+    match = VARIANT_RESOLUTION.search(variant["attributes"])
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+# label of a variant of a master playlist: its height (i.e. 1080p), else its playlist name
+def variant_label(variant: dict) -> str:
+    resolution = variant_resolution(variant)
+    if resolution:
+        return f"{resolution[1]}p"
+    return variant["uri"].rsplit("/", 1)[-1].rsplit(".", 1)[0]
+
+#
+# short description of a title for listings, i.e. ["1:32:10", "1080p", "3 renditions", "2.1 GB"]
+#
+def summary(entry: dict) -> list:
+    parts = []
+    if entry.get("duration"):
+        minutes, seconds = divmod(int(entry["duration"]), 60)
+        hours, minutes = divmod(minutes, 60)
+        parts.append(f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}")
+    if entry.get("height"):
+        parts.append(f"{entry['height']}p")
+    if len(entry.get("renditions", [])) > 1:
+        parts.append(f"{len(entry['renditions'])} renditions")
+    if entry.get("size"):
+        parts.append(f"{entry['size'] / 1024**3:.1f} GB" if entry["size"] >= 1024**3 else f"{entry['size'] // 1024**2} MB")
+    return parts
+
+#
+# Per-title metadata (duration, resolution, HLS renditions, size and a poster frame) computed in
+# the background over the catalog index so listings can show it without any object storage call
+# on the request path.  One worker at a time computes metadata for titles that are new or whose
+# etag changed, with ffprobe and ffmpeg (when installed) running in a process pool.  HLS
+# durations and renditions come from the cached playlist (its variants when output.m3u8 is a
+# master playlist) and the catalog.  Like the catalog the
+# shared copy lives under two keys in the cache (see SharedIndex), and posters under one key
+# per title:
+# metadata:meta = {"version": 1712345678.9}
+# metadata:index = {"version": ..., "entries": {"Movies/a.mp4": {"etag": "...", "size": 123,
+#                   "duration": 5400.0, "width": 1920, "height": 1080, "renditions": ["1080p"],
+#                   "poster": true}}}
+# poster:Movies/a.mp4 = {"etag": "...", "jpeg": "<base64>"}
+#
+class MetadataIndex(SharedIndex):
+    CACHE_KEY = "metadata:index"
+    META_KEY = "metadata:meta"
+    LOCK_NAME = "metadata:refresh"
+    FIELD = "entries"
+    NAME = "metadata"
+    LOCK_TTL = 60*60
+    # results are published every this many titles so a long first run shows progress
+    PUBLISH_EVERY = 50
+
+    def __init__(self, cmd, catalog, playlist_proxy, par_manager, cache, interval: int, max_workers: int):
+        super().__init__(cache)
+        self.cmd = cmd
+        self.catalog = catalog
+        self.playlist_proxy = playlist_proxy
+        self.par_manager = par_manager
+        self.interval = interval
+        self.max_workers = max(1, max_workers)
+        self.entries = {}
+        self.processed_catalog = None
+        self.last_run = 0
+        self.ffprobe = shutil.which("ffprobe")
+        self.ffmpeg = shutil.which("ffmpeg")
+
+    # poll the shared copy every few seconds and process new titles when the catalog changes
+    def start(self):
+        if not self.ffprobe or not self.ffmpeg:
+            logging.info("ffprobe/ffmpeg not found; title metadata is limited to what playlists and listings provide")
+        self.start_polling(self.POLL_INTERVAL)
+
+    # metadata of a title, or None if it was not computed yet.  never touches the cache
+    def get(self, name: str):
+        return self.entries.get(name)
+
+    # jpeg poster of a title from the cache
+    def get_poster(self, name: str):
+        poster = self.cache.get_value(f"poster:{name}")
+        if not poster:
+            return None
+        return base64.b64decode(poster["jpeg"])
+
+    # callers hold self.lock
+    def adopt(self, value: dict):
+        self.entries = value
+
+    #
+    # compute metadata for titles that are new or changed since the last run and drop the
+    # metadata of removed titles.  runs when the catalog changed or every interval seconds
+    #
+    def refresh(self):
+        self.sync()
+        catalog = self.catalog.get_catalog()
+        if catalog is self.processed_catalog and time.time() - self.last_run < self.interval:
+            return
+        token = self.cache.acquire_lock(self.LOCK_NAME, self.LOCK_TTL)
+        if not token:
+            return
+
+        try:
+            self.sync()
+            started = time.time()
+            videos = {video.name: video for folder in catalog.sections() for video in catalog.videos(folder)}
+            entries = {name: entry for name, entry in self.entries.items() if name in videos}
+            for name in self.entries.keys() - videos.keys():
+                self.cache.set_value(f"poster:{name}", None, ttl=1)
+            pending = [video for name, video in videos.items() if name not in entries or entries[name].get("etag") != video.etag]
+            removed = len(self.entries) - len(entries)
+
+            if pending:
+                self._process(catalog, pending, entries)
+            elif removed:
+                self._publish(entries)
+            self.processed_catalog = catalog
+            self.last_run = time.time()
+            if pending or removed:
+                logging.info(f"Metadata computed for {len(pending)} titles ({removed} removed) in {time.time() - started:.2f}s")
+        finally:
+            self.cache.release_lock(self.LOCK_NAME, token)
+
+    def _process(self, catalog, pending: list, entries: dict):
+        jobs = []
+        for video in pending:
+            try:
+                jobs.append(self._job(catalog, video))
+            except Exception as e:
+                logging.warning("Unable to prepare metadata for '%s': %s", video.name, e)
+
+        # spawned workers don't inherit the threads, locks and sockets of this process
+        context = multiprocessing.get_context("spawn")
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context) as executor:
+            futures = {executor.submit(extract, job): job for job in jobs}
+            for future in as_completed(futures):
+                if self.stop_event.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                job = futures[future]
+                try:
+                    entry, poster = future.result()
+                except Exception as e:
+                    logging.warning("Metadata extraction failed for '%s': %s", job["name"], e)
+                    continue
+                if poster:
+                    self.cache.set_value(f"poster:{job['name']}", {"etag": entry["etag"], "jpeg": base64.b64encode(poster).decode("ascii")})
+                    entry["poster"] = True
+                entries[job["name"]] = entry
+                done += 1
+                if done % self.PUBLISH_EVERY == 0:
+                    self._publish(dict(entries))
+        self._publish(entries)
+
+    #
+    # what the process pool needs for one title: what is already known from the catalog and
+    # the playlist, and with ffmpeg installed a url to probe (the mp4, or for HLS the segment
+    # the poster is taken from)
+    #
+    def _job(self, catalog, video) -> dict:
+        known = {"etag": video.etag, "size": video.size}
+        job = {"name": video.name, "known": known, "ffprobe": self.ffprobe, "ffmpeg": self.ffmpeg}
+        offset = POSTER_OFFSET
+        url = None
+        if video.is_hls:
+            playlist = self.playlist_proxy.get_playlist(video)
+            if playlist["variants"]:
+                playlist, prefix = self._master_playlist(video, playlist, known)
+            else:
+                prefix = video.prefix
+                renditions = catalog.find_renditions(video)
+                known["renditions"] = [rendition.label or "source" for rendition in renditions]
+                height = RENDITION_HEIGHT.search(video.display_name)
+                if height:
+                    known["height"] = int(height.group(1))
+                    known["width"] = (known["height"] * 16 // 9) // 2 * 2
+            if playlist is not None:
+                known["duration"] = round(playlist["duration"], 1)
+            # the segment playing at the poster offset, and the offset within it
+            position = 0
+            segment = None
+            for segment in (playlist or {}).get("segments", []):
+                if position + (segment["duration"] or 0) > POSTER_OFFSET:
+                    break
+                position += segment["duration"] or 0
+            if segment is not None and self.ffmpeg:
+                offset = max(0, POSTER_OFFSET - position)
+                url = self.cmd.os_endpoint + self.par_manager.get_access_uri(video) + prefix + segment["uri"]
+        elif self.ffprobe or self.ffmpeg:
+            url = self.par_manager.get_par_url(video)
+        known = {key: value for key, value in known.items() if value is not None}
+        job.update(known=known, url=url, offset=offset)
+        return job
+
+    #
+    # output.m3u8 is a master playlist: the renditions and the resolution come from its
+    # variants, and the duration and poster from the media playlist of the smallest variant
+    # (the cheapest to read).  returns that media playlist (None if no variant is in the
+    # title's folder) and the prefix its segment uris are relative to
+    #
+    def _master_playlist(self, video, playlist: dict, known: dict) -> tuple:
+        variants = playlist["variants"]
+        known["renditions"] = [variant_label(variant) for variant in variants]
+        resolutions = [resolution for resolution in map(variant_resolution, variants) if resolution]
+        if resolutions:
+            known["width"], known["height"] = max(resolutions, key=lambda resolution: resolution[1])
+        local = [variant for variant in variants if "://" not in variant["uri"] and not variant["uri"].startswith("/")]
+        if not local:
+            return None, video.prefix
+        smallest = min(local, key=lambda variant: (variant_resolution(variant) or (0, 0))[1])
+        media = Video(video.prefix + smallest["uri"], video.display_name, video.folder, True, etag=video.etag)
+        return self.playlist_proxy.get_playlist(media), media.prefix
+
+    def _publish(self, entries: dict):
+        with self.lock:
+            self.entries = entries
+            self.publish(entries, time.time())
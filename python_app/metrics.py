@@ -0,0 +1,277 @@
+from flask import g, has_request_context
+from bisect import bisect_left
+import os
+import time
+import socket
+import logging
+import threading
+
+# latency buckets in seconds, from a cache hit to a slow object storage listing
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+#
+# cumulative latency histogram in the Prometheus style.  callers hold the registry lock
+#
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+#
+# In-process registry of request, object storage and cache metrics rendered in the Prometheus
+# text format.  Histograms and counters are keyed by metric name and a tuple of label pairs.
+# Gauges are callables evaluated when the metrics are scraped.  Each worker process keeps its
+# own registry; with a MetricsPublisher the registries of the other workers on the host are
+# merged in (others) and every series carries a worker label.
+#
+class Metrics:
+    def __init__(self, prefix: str = "homemovies"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.help = {}
+        self.worker = None
+        self.others = {}
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def observe(self, name: str, labels: dict, seconds: float):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, labels: dict, amount: int = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    # sum of a counter over every label set that includes the given labels, across workers
+    def total(self, name: str, **labels) -> int:
+        wanted = set(labels.items())
+        histograms, counters = self._series()
+        return sum(value for (metric, metric_labels), value in counters.items() if metric == name and wanted <= set(metric_labels))
+
+    # counters and histograms of this worker in a json friendly form, for other workers
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "histograms": [[name, labels, list(histogram.counts), histogram.sum, histogram.count] for (name, labels), histogram in self.histograms.items()],
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+            }
+
+    # replace the snapshots of the other workers: {worker id: snapshot}
+    def set_others(self, others: dict):
+        with self.lock:
+            self.others = others
+
+    # histograms and counters of this worker and of the other workers, keyed by name and labels.
+    # with other workers every label set gets the worker it came from
+    def _series(self) -> tuple:
+        with self.lock:
+            if self.worker is None:
+                return ({key: (list(histogram.counts), histogram.sum, histogram.count) for key, histogram in self.histograms.items()}, dict(self.counters))
+            snapshots = dict(self.others)
+        snapshots[self.worker] = self.snapshot()
+        histograms = {}
+        counters = {}
+        for worker, snapshot in snapshots.items():
+            for name, labels, counts, total, count in snapshot["histograms"]:
+                histograms[(name, _with_worker(labels, worker))] = (counts, total, count)
+            for name, labels, value in snapshot["counters"]:
+                counters[(name, _with_worker(labels, worker))] = value
+        return histograms, counters
+
+    def gauge(self, name: str, read, text: str = None):
+        self.gauges[name] = read
+        if text:
+            self.describe(name, text)
+
+    def render(self) -> str:
+        histograms, counters = self._series()
+
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            self._header(lines, name, "histogram")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.prefix}_{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{self.prefix}_{name}_sum{_labels(labels)} {total:.6f}")
+                lines.append(f"{self.prefix}_{name}_count{_labels(labels)} {count}")
+        for name in sorted({name for name, _ in counters}):
+            self._header(lines, name, "counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            self._header(lines, name, "gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: list, name: str, metric_type: str):
+        if name in self.help:
+            lines.append(f"# HELP {self.prefix}_{name} {self.help[name]}")
+        lines.append(f"# TYPE {self.prefix}_{name} {metric_type}")
+
+def _with_worker(labels, worker: str) -> tuple:
+    return tuple(sorted([tuple(label) for label in labels] + [("worker", worker)]))
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+#
+# Shares the metrics of the worker processes on this host through the cache provider, so that
+# a scrape, which reaches whichever worker accepts the connection, reports every worker.  Each
+# worker publishes a snapshot of its counters and histograms every PUBLISH_INTERVAL seconds
+# and keeps itself in the list of live workers; a scrape reads the snapshots of the others.
+# Series carry a worker label, so a counter never jumps between scrapes and a restarted worker
+# shows up as a new series.  Keys are per host since every container is scraped on its own:
+# metrics:<host>:workers = {"<host>-<pid>": 1712345678.9, ...}
+# metrics:<host>:worker:<host>-<pid> = {"histograms": [...], "counters": [...]}
+#
+class MetricsPublisher:
+    PUBLISH_INTERVAL = 15
+    # workers that stopped publishing for this long are dropped
+    WORKER_TTL = 60
+    LOCK_TTL = 5
+
+    def __init__(self, metrics: Metrics, cache):
+        self.metrics = metrics
+        self.cache = cache
+        host = socket.gethostname()
+        self.prefix = f"metrics:{host}"
+        self.worker = f"{host}-{os.getpid()}"
+        metrics.worker = self.worker
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def publish(self):
+        self.cache.set_value(f"{self.prefix}:worker:{self.worker}", self.metrics.snapshot(), ttl=self.WORKER_TTL)
+        token = self.cache.acquire_lock(f"{self.prefix}:workers", self.LOCK_TTL)
+        if not token:
+            return
+        try:
+            now = time.time()
+            workers = self.cache.get_value(f"{self.prefix}:workers") or {}
+            workers = {worker: seen for worker, seen in workers.items() if now - seen < self.WORKER_TTL}
+            workers[self.worker] = now
+            self.cache.set_value(f"{self.prefix}:workers", workers, ttl=self.WORKER_TTL)
+        finally:
+            self.cache.release_lock(f"{self.prefix}:workers", token)
+
+    # load the latest snapshots of the other live workers into the registry
+    def collect(self):
+        workers = [worker for worker in self.cache.get_value(f"{self.prefix}:workers") or {} if worker != self.worker]
+        snapshots = self.cache.get_value_many([f"{self.prefix}:worker:{worker}" for worker in workers])
+        self.metrics.set_others({worker: snapshots[f"{self.prefix}:worker:{worker}"] for worker in workers if snapshots[f"{self.prefix}:worker:{worker}"]})
+
+    def _run(self):
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                logging.error("Error publishing metrics: " + str(e))
+            if self.stop_event.wait(self.PUBLISH_INTERVAL):
+                return
+
+#
+# add time spent in a dependency to the current request so it can be reported in the
+# Server-Timing header.  calls made by background threads are not attributed to a request
+#
+def add_request_timing(dependency: str, seconds: float):
+    if has_request_context():
+        timings = g.setdefault("dependency_timings", {})
+        timings[dependency] = timings.get(dependency, 0.0) + seconds
+
+#
+# Proxy in front of a client object (the OCI ObjectStorageClient or a cache provider) that
+# records a count, an error count and a latency histogram for every method call.  Methods are
+# wrapped on first use and the wrapper is kept so later calls cost one dict lookup.  For cache
+# providers, lookups (get_* and is_*) also count hits and misses.
+#
+class InstrumentedClient:
+    def __init__(self, client, metrics: Metrics, dependency: str, count_hits: bool = False):
+        self._client = client
+        self._metrics = metrics
+        self._dependency = dependency
+        self._count_hits = count_hits
+        metrics.describe(f"{dependency}_call_seconds", f"Latency of {dependency} calls by method")
+        metrics.describe(f"{dependency}_errors_total", f"Failed {dependency} calls by method")
+        if count_hits:
+            metrics.describe(f"{dependency}_lookups_total", f"{dependency} lookups by method and result")
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        metrics = self._metrics
+        dependency = self._dependency
+        labels = {"method": name}
+        count_hits = self._count_hits and name.startswith(("get_", "is_"))
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception:
+                metrics.increment(f"{dependency}_errors_total", labels)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                metrics.observe(f"{dependency}_call_seconds", labels, elapsed)
+                add_request_timing(dependency, elapsed)
+            if count_hits:
+                _count_lookups(metrics, dependency, name, result)
+            return result
+
+        self.__dict__[name] = call
+        return call
+
+# a lookup misses when nothing was found: None, or False from get_authenticated and the is_*
+# checks of a missing session
+def _found(value) -> bool:
+    return value is not None and value is not False
+
+def _count_lookups(metrics: Metrics, dependency: str, method: str, result):
+    # lookups returning several values (get_shared_with_par) hit when the first one is found
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, dict):
+        hits = sum(1 for value in result.values() if _found(value))
+        misses = len(result) - hits
+    else:
+        hits, misses = (1, 0) if _found(result) else (0, 1)
+    if hits:
+        metrics.increment(f"{dependency}_lookups_total", {"method": method, "result": "hit"}, hits)
+    if misses:
+        metrics.increment(f"{dependency}_lookups_total", {"method": method, "result": "miss"}, misses)
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from listing import HLS_SUFFIX
+from singleflight import SingleFlight
+import pytz
+import oci
+import time
+import logging
+
+#
+# object name prefix a PAR for the named object is pooled under: the HLS folder for HLS
+# playlists and segments, the object itself otherwise.  the share lookup script in cache.py
+# applies the same rule
+#
+def par_scope(name: str) -> str:
+    if HLS_SUFFIX in name:
+        return name.rsplit("/", 1)[0] + "/"
+    return name
+
+#
+# Pool of pre-authenticated requests (PARs) kept in the cache provider so that every worker can
+# hand out an existing PAR while it still has enough lifetime left for a viewer to finish the
+# movie.  A PAR is only created on a miss.  PARs are pooled per object, or per HLS folder for HLS
+# titles since the player has to read every segment in the folder, and each PAR is scoped to
+# that object name prefix so it can't read anything else in the bucket.  Cache entries look like:
+# par:folder/title.mp4 = {"access_uri": "/p/.../n/ns/b/bucket/o/", "expires": 1712345678.9}
+#
+# Concurrent misses for the same scope are coalesced so a burst of viewers opening a new title
+# creates one PAR: within a process through a SingleFlight, and across workers and containers
+# through a cache lock while the other callers wait for the pooled entry to appear.
+#
+class ParManager:
+    # how long a PAR creation may hold the lock, and how long other workers wait for its result
+    CREATE_LOCK_TTL = 10
+    CREATE_WAIT = 5
+    CREATE_POLL = 0.1
+
+    def __init__(self, cmd, os_client, namespace, cache, lifetime: int, min_remaining: int):
+        self.cmd = cmd
+        self.os_client = os_client
+        self.namespace = namespace
+        self.cache = cache
+        self.lifetime = lifetime * 60
+        self.min_remaining = min(min_remaining * 60, self.lifetime)
+        self.flights = SingleFlight()
+
+    # return a url the player can use to read the video.  entry is the pooled PAR when the
+    # caller already looked it up (see CacheProvider.get_shared_with_par)
+    def get_par_url(self, video, entry: dict = None) -> str:
+        return self.cmd.os_endpoint + self.get_access_uri(video, entry) + video.name
+
+    def get_access_uri(self, video, entry: dict = None) -> str:
+        scope = par_scope(video.name)
+        if entry is None:
+            entry = self.cache.get_value(f"par:{scope}")
+        if self.usable(entry):
+            return entry["access_uri"]
+        return self.flights.do(scope, lambda: self._pooled_or_create(scope))
+
+    def usable(self, entry: dict) -> bool:
+        return bool(entry) and entry["expires"] - time.time() >= self.min_remaining
+
+    # runs once per scope at a time in this process.  another worker may be creating the same
+    # PAR, in which case wait a little for it rather than creating a second one
+    def _pooled_or_create(self, scope: str) -> str:
+        entry = self.cache.get_value(f"par:{scope}")
+        if self.usable(entry):
+            return entry["access_uri"]
+
+        token = self.cache.acquire_lock(f"par:{scope}", self.CREATE_LOCK_TTL)
+        if not token:
+            deadline = time.time() + self.CREATE_WAIT
+            while time.time() < deadline:
+                time.sleep(self.CREATE_POLL)
+                entry = self.cache.get_value(f"par:{scope}")
+                if self.usable(entry):
+                    return entry["access_uri"]
+            logging.warning("Timed out waiting for another worker to create a PAR for '%s'", scope)
+
+        try:
+            entry = self.create(scope)
+            # drop the cache entry once the PAR no longer has enough lifetime left to hand out
+            self.cache.set_value(f"par:{scope}", entry, ttl=int(self.lifetime - self.min_remaining) or 1)
+        finally:
+            if token:
+                self.cache.release_lock(f"par:{scope}", token)
+        return entry["access_uri"]
+
+    # expired PARs are cleaned up by the background ParReaper, never on the request path
+    def create(self, scope: str) -> dict:
+        now = datetime.utcnow().replace(tzinfo=pytz.utc)
+        expiry_time = now + timedelta(seconds=self.lifetime)
+        par_response = self.os_client.create_preauthenticated_request(
+            self.namespace,
+            self.cmd.bucket,
+            create_preauthenticated_request_details=oci.object_storage.models.CreatePreauthenticatedRequestDetails(
+                name=scope + str(expiry_time),
+                object_name=scope,
+                access_type="AnyObjectRead",
+                time_expires=expiry_time,
+                bucket_listing_action="Deny"
+                ))
+        logging.debug("Created PAR for '%s' expiring %s", scope, expiry_time)
+        return {"access_uri": par_response.data.access_uri, "expires": expiry_time.timestamp()}
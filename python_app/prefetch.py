@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import logging
+import threading
+
+#
+# Predictive prefetch of HLS segments into a bounded segment store of their own (a ChunkCache in
+# a separate directory, so prefetched segments never push played chunks out of the stream cache).
+# When a movie page renders the first initial_segments of the title are queued, and while the
+# title plays every /stream request for one of its segments moves a window of window_segments
+# ahead of it.  Downloads run on a fixed size pool which caps concurrent object storage reads
+# per worker.  Queued downloads that fall out of the window after a seek are cancelled, as is
+# everything for a viewer that leaves the page or stops requesting segments for idle_timeout
+# seconds.
+#
+class Prefetcher:
+    def __init__(self, stream_proxy, playlist_proxy, store, initial_segments: int = 3, window_segments: int = 5, max_workers: int = 4, idle_timeout: int = 60):
+        self.stream_proxy = stream_proxy
+        self.playlist_proxy = playlist_proxy
+        self.store = store
+        self.initial_segments = max(0, initial_segments)
+        self.window_segments = max(0, window_segments)
+        self.idle_timeout = max(1, idle_timeout)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        # (viewer, playlist name) -> Playback
+        self.playbacks = {}
+        # segment name -> future, shared by every viewer so a segment is only downloaded once
+        self.pending = {}
+        self.counters = {"queued": 0, "fetched": 0, "cancelled": 0, "errors": 0}
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="prefetch-idle", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    # snapshot of counts for the admin endpoint
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, playbacks=len(self.playbacks), pending=len(self.pending))
+
+    # a viewer opened the movie page of an HLS video: queue the first segments.  the playlist is
+    # loaded on the pool so the page render never waits on object storage
+    def begin(self, viewer: str, video):
+        if not video.is_hls:
+            return
+        self.executor.submit(self._begin, viewer, video)
+
+    # a viewer requested an object through /stream.  if it is a segment of a title the viewer is
+    # playing, slide the window ahead of it
+    def touch(self, viewer: str, name: str):
+        with self.lock:
+            playback = self._find_playback(viewer, name)
+            if playback is None:
+                return
+            playback.last_seen = time.time()
+            position = playback.index.get(name)
+            if position is None:
+                return
+            wanted = playback.segments[position + 1:position + 1 + self.window_segments]
+            self._schedule(playback, wanted)
+
+    # the viewer left the page (beacon) or stopped playing
+    def end(self, viewer: str, name: str):
+        with self.lock:
+            playback = self.playbacks.pop((viewer, name), None)
+            if playback is not None:
+                self._cancel(playback, set())
+
+    def _begin(self, viewer: str, video):
+        try:
+            playlist = self.playlist_proxy.get_playlist(video)
+        except Exception as e:
+            self._count("errors")
+            logging.error(f"Error loading playlist '{video.name}' for prefetch: " + str(e))
+            return
+        segments = [video.prefix + segment["uri"] for segment in playlist["segments"] if "://" not in segment["uri"] and not segment["uri"].startswith("/")]
+        with self.lock:
+            old = self.playbacks.get((viewer, video.name))
+            if old is not None:
+                self._cancel(old, set())
+            playback = Playback(video.name, video.prefix, segments)
+            self.playbacks[(viewer, video.name)] = playback
+            self._schedule(playback, segments[:self.initial_segments])
+
+    # callers hold self.lock
+    def _find_playback(self, viewer: str, name: str):
+        for (playback_viewer, _), playback in self.playbacks.items():
+            if playback_viewer == viewer and name.startswith(playback.prefix):
+                return playback
+        return None
+
+    # callers hold self.lock.  queue the wanted segments and cancel this playback's queued
+    # downloads that are no longer wanted
+    def _schedule(self, playback, wanted: list):
+        self._cancel(playback, set(wanted))
+        for name in wanted:
+            if name in playback.queued:
+                continue
+            future = self.pending.get(name)
+            if future is None:
+                future = self.executor.submit(self._fetch, name)
+                self.pending[name] = future
+                self.counters["queued"] += 1
+            playback.queued[name] = future
+
+    # callers hold self.lock.  a queued download is only cancelled once no other playback wants it
+    def _cancel(self, playback, keep: set):
+        for name in [name for name in playback.queued if name not in keep]:
+            future = playback.queued.pop(name)
+            if any(name in other.queued for other in self.playbacks.values() if other is not playback):
+                continue
+            if future.cancel():
+                self.pending.pop(name, None)
+                self.counters["cancelled"] += 1
+
+    def _fetch(self, name: str):
+        try:
+            self.stream_proxy.prefetch(name, self.store)
+            self._count("fetched")
+        except Exception as e:
+            self._count("errors")
+            logging.error(f"Error prefetching '{name}': " + str(e))
+        finally:
+            with self.lock:
+                self.pending.pop(name, None)
+                for playback in self.playbacks.values():
+                    playback.queued.pop(name, None)
+
+    # drop playbacks whose viewer has not requested a segment for idle_timeout seconds
+    def _run(self):
+        while not self.stop_event.wait(max(1, self.idle_timeout // 2)):
+            cutoff = time.time() - self.idle_timeout
+            with self.lock:
+                for key in [key for key, playback in self.playbacks.items() if playback.last_seen < cutoff]:
+                    self._cancel(self.playbacks.pop(key), set())
+
+    def _count(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
+
+#
+# prefetch state of one viewer playing one HLS title
+#
+class Playback:
+    def __init__(self, name: str, prefix: str, segments: list):
+        self.name = name
+        self.prefix = prefix
+        self.segments = segments
+        self.index = {segment: i for i, segment in enumerate(segments)}
+        # segment name -> future of downloads this playback is waiting on
+        self.queued = {}
+        self.last_seen = time.time()
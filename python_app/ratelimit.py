@@ -0,0 +1,24 @@
+import logging
+
+# endpoints that call object storage or check passwords and are limited per client with --rate_limit
+RATE_LIMITED_ENDPOINTS = ("detail", "shared", "playlist", "master_playlist", "share_url", "share_urls", "login_post", "authenticate_post")
+
+#
+# Token bucket rate limits per client and route.  Buckets live in the cache provider, so with
+# Redis every worker and container draws from the same bucket.  A client may make burst
+# requests to a route at once and then rate requests per second.  If the cache can't be reached
+# the request is let through rather than failing the page.
+#
+class RateLimiter:
+    def __init__(self, cache, rate: float, burst: int):
+        self.cache = cache
+        self.rate = rate
+        self.burst = max(1, burst)
+
+    # 0 when the request may go ahead, otherwise the seconds until the client may retry
+    def check(self, client: str, route: str) -> float:
+        try:
+            return self.cache.take_token(f"{route}:{client}", self.rate, self.burst)
+        except Exception as e:
+            logging.warning("Rate limit check for '%s' failed, allowing request: %s", route, e)
+            return 0
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pytz
+import time
+import logging
+import threading
+
+#
+# Background worker that deletes expired pre-authenticated requests (PARs) so that request
+# handlers never have to.  Every interval seconds it pages through the bucket's PARs and deletes
+# the expired ones in batches on a small worker pool.  Each batch takes at least one second which
+# caps the delete rate at batch_size per second.  A cache lock makes sure only one worker across
+# all processes/containers reaps at a time.
+#
+class ParReaper:
+    LOCK_NAME = "par:reaper"
+
+    def __init__(self, cmd, os_client, namespace, cache, interval: int, batch_size: int = 10, max_workers: int = 4):
+        self.cmd = cmd
+        self.os_client = os_client
+        self.namespace = namespace
+        self.cache = cache
+        self.interval = max(1, interval)
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.counters = {
+            "runs": 0,
+            "skipped_runs": 0,
+            "listed": 0,
+            "deleted": 0,
+            "errors": 0,
+            "last_run": None,
+            "last_duration": None,
+            "last_listed": 0,
+            "last_deleted": 0,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="par-reaper", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    # snapshot of counts and timings for the admin endpoint
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, interval=self.interval, batch_size=self.batch_size)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.reap()
+            except Exception as e:
+                self._count("errors")
+                logging.error("Error reaping expired PARs: " + str(e))
+
+    # run one pass.  returns the number of PARs deleted
+    def reap(self) -> int:
+        token = self.cache.acquire_lock(self.LOCK_NAME, self.interval)
+        if not token:
+            self._count("skipped_runs")
+            return 0
+
+        try:
+            started = time.time()
+            now = datetime.utcnow().replace(tzinfo=pytz.utc)
+            listed = 0
+            expired = []
+            # finish paging before deleting so that deletes can't shift the pages
+            for par in self._list_pars():
+                listed += 1
+                if par.time_expires < now:
+                    expired.append(par.id)
+
+            deleted = 0
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="par-reaper") as executor:
+                for i in range(0, len(expired), self.batch_size):
+                    if self.stop_event.is_set():
+                        break
+                    deleted += self._delete_batch(executor, expired[i:i + self.batch_size])
+
+            duration = time.time() - started
+            with self.lock:
+                self.counters["runs"] += 1
+                self.counters["listed"] += listed
+                self.counters["deleted"] += deleted
+                self.counters["last_run"] = started
+                self.counters["last_duration"] = duration
+                self.counters["last_listed"] = listed
+                self.counters["last_deleted"] = deleted
+            logging.info(f"PAR reaper deleted {deleted} of {listed} PARs in {duration:.2f}s")
+            return deleted
+        finally:
+            self.cache.release_lock(self.LOCK_NAME, token)
+
+    def _list_pars(self):
+        page = None
+        while True:
+            response = self.os_client.list_preauthenticated_requests(self.namespace, self.cmd.bucket, page=page)
+            for par in response.data:
+                yield par
+            page = response.next_page
+            if not page:
+                break
+
+    def _delete_batch(self, executor, par_ids) -> int:
+        started = time.time()
+        deleted = 0
+        for result in executor.map(self._delete, par_ids):
+            deleted += result
+        # rate limit: at most one batch per second
+        elapsed = time.time() - started
+        if elapsed < 1:
+            self.stop_event.wait(1 - elapsed)
+        return deleted
+
+    def _delete(self, par_id) -> int:
+        try:
+            self.os_client.delete_preauthenticated_request(self.namespace, self.cmd.bucket, par_id)
+            return 1
+        except Exception as e:
+            self._count("errors")
+            logging.error(f"Error deleting PAR {par_id}: " + str(e))
+            return 0
+
+    def _count(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
@@ -0,0 +1,96 @@
+from bisect import bisect_left
+import re
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+# sort keys offered to clients and the default order of each
+SORT_KEYS = {
+    "name": lambda video: video.display_name.lower(),
+    "time_created": lambda video: video.time_created or "",
+    "size": lambda video: video.size or 0,
+}
+DEFAULT_DESCENDING = {"name": False, "time_created": True, "size": True}
+
+# split a display name or query into lower case words, i.e. "Summer 2022.1080p" -> summer, 2022, 1080p
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+#
+# Inverted index over the display names of a catalog, built once per catalog version:
+#   postings: token -> set of object names of the videos whose display name has the token
+#   tokens: every token in sorted order, so that all tokens starting with a prefix are one
+#           contiguous run found with a binary search
+# A query matches the videos that have, for every query word, a token starting with that word,
+# so lookups cost O(log tokens) plus the size of the matches rather than a scan of the catalog.
+# Sorted listings per folder are also built lazily and kept for the life of the index.
+#
+class SearchIndex:
+    def __init__(self, videos):
+        self.videos = {}
+        self.postings = {}
+        for video in videos:
+            self.videos[video.name] = video
+            for token in tokenize(video.display_name):
+                self.postings.setdefault(token, set()).add(video.name)
+        self.tokens = sorted(self.postings)
+        self.folders = {video.folder for video in self.videos.values()}
+        self.sorted_lists = {}
+
+    # every token that starts with prefix
+    def expand(self, prefix: str) -> list:
+        start = bisect_left(self.tokens, prefix)
+        end = start
+        while end < len(self.tokens) and self.tokens[end].startswith(prefix):
+            end += 1
+        return self.tokens[start:end]
+
+    # videos matching every word of the query, optionally limited to one folder, in sort order
+    def search(self, query: str, folder: str = None, sort: str = "name", descending: bool = None) -> list:
+        words = tokenize(query)
+        if not words:
+            return []
+        matches = None
+        # longer words usually match fewer titles, so start with them to keep the intersections small
+        for word in sorted(words, key=len, reverse=True):
+            names = set()
+            for token in self.expand(word):
+                names |= self.postings[token]
+            matches = names if matches is None else matches & names
+            if not matches:
+                return []
+        results = [self.videos[name] for name in matches if folder is None or self.videos[name].folder == folder]
+        return self._sort(results, sort, descending)
+
+    # all videos, or the videos of one folder, in sort order.  only listings of folders in the
+    # catalog are kept so that requests for made up folders can't grow the index
+    def listing(self, folder: str = None, sort: str = "name", descending: bool = None) -> list:
+        if folder is not None and folder not in self.folders:
+            return []
+        descending = DEFAULT_DESCENDING[sort] if descending is None else descending
+        key = (folder, sort, descending)
+        listing = self.sorted_lists.get(key)
+        if listing is None:
+            videos = [video for video in self.videos.values() if folder is None or video.folder == folder]
+            listing = self._sort(videos, sort, descending)
+            self.sorted_lists[key] = listing
+        return listing
+
+    def _sort(self, videos: list, sort: str, descending: bool = None) -> list:
+        descending = DEFAULT_DESCENDING[sort] if descending is None else descending
+        # ties keep name order so that pages are stable
+        videos = sorted(videos, key=lambda video: video.name)
+        return sorted(videos, key=SORT_KEYS[sort], reverse=descending)
+
+#
+# one fixed size page of a list of results
+#
+def paginate(results: list, page: int, page_size: int) -> dict:
+    pages = max(1, (len(results) + page_size - 1) // page_size)
+    page = min(max(1, page), pages)
+    return {
+        "page": page,
+        "pages": pages,
+        "page_size": page_size,
+        "total": len(results),
+        "items": results[(page - 1) * page_size:page * page_size],
+    }
@@ -0,0 +1,46 @@
+from gunicorn.app.base import BaseApplication
+import logging
+
+#
+# Production server running the Flask app under gunicorn with multiple worker processes and
+# threads.  The app is not preloaded: every worker calls app_factory after it is forked so that
+# OCI clients, cache connections and background threads are created per process.  Sending
+# SIGHUP to the master process gracefully reloads the workers without dropping requests.
+#
+# With the gevent worker class every request runs in a greenlet and blocking OCI and Redis calls
+# yield while they wait on the network, so a single process can hold hundreds of concurrent
+# /check_auth polls and video page loads without adding threads.
+#
+class ProductionServer(BaseApplication):
+    def __init__(self, app_factory, options: dict):
+        self.app_factory = app_factory
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.app_factory()
+
+def serve(cmd, app_factory):
+    options = {
+        "bind": "0.0.0.0:5000",
+        "workers": cmd.workers,
+        "threads": cmd.threads,
+        "worker_class": cmd.worker_class,
+        "worker_connections": cmd.worker_connections,
+        "preload_app": False,
+        # workers booting longer than this are killed; CatalogIndex.STARTUP_WAIT stays well below it
+        "timeout": 120,
+        "graceful_timeout": 30,
+        "keepalive": 5,
+        "accesslog": "-",
+    }
+    if cmd.worker_class == "gevent":
+        logging.info(f"Starting production server with {cmd.workers} gevent workers and {cmd.worker_connections} connections per worker")
+    else:
+        logging.info(f"Starting production server with {cmd.workers} workers and {cmd.threads} threads per worker")
+    ProductionServer(app_factory, options).run()
@@ -1,21 +1,51 @@
-from flask import Flask, render_template, request, redirect, flash, jsonify, url_for, session, app
-from flask_login import LoginManager, login_user, logout_user, login_required, UserMixin
-from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, flash, jsonify, url_for, session, app, Response, stream_with_context, make_response, g
+from flask_login import LoginManager, login_user, logout_user, login_required, UserMixin, current_user
+from datetime import timedelta
 from html import unescape
 from cache import CacheProviderFactory, LocalCacheProvider, RedisCacheProvider
-import pytz
+from catalog import CatalogIndex, Video
+from listing import HLS_SUFFIX, HLS_PLAYLIST
+from par import ParManager
+from reaper import ParReaper
+from hls import PlaylistProxy, render_master_playlist
+from stream import ChunkCache, StreamProxy
+from search import SORT_KEYS, paginate
+from http_cache import STATIC_MAX_AGE, make_etag, directory_digest, compress_response
+from metrics import Metrics, MetricsPublisher, InstrumentedClient
+from prefetch import Prefetcher
+from metadata import MetadataIndex, summary
+from ratelimit import RateLimiter, RATE_LIMITED_ENDPOINTS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import oci
+import os
 import secrets
 import uuid
 import logging
 import sys
 import json
+import time
+import math
 
-def create_app(cmd, os_client, namespace):
+# longest a single check_auth long poll may block, and how long an auth_events stream stays open
+MAX_AUTH_WAIT = 25
+# EventSource reconnects on its own once a stream ends, so streams are kept short
+AUTH_EVENTS_DURATION = 60*2
+
+# titles per page of the home page, /search and /api/catalog
+PAGE_SIZE = 50
+
+# most share links /share_urls creates in one request
+MAX_BULK_SHARES = 500
+
+def create_app(cmd, os_client, namespace, snapshot=None):
     app = Flask(__name__)
 
     app.config['SECRET_KEY'] = str(secrets.token_hex)
 
+    # trust the X-Forwarded-For/Proto headers set by the load balancer(s) in front of the app
+    if cmd.proxy_count:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=cmd.proxy_count, x_proto=cmd.proxy_count)
+
     login_manager = LoginManager()
     login_manager.login_view = 'login'
     login_manager.init_app(app)
@@ -24,54 +54,120 @@ def create_app(cmd, os_client, namespace):
     def load_user(username):
         return User(username)
     
-    # instantiate a logger
-    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    # instantiate a logger.  debug logging is only enabled with --debug
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if cmd.debug else logging.INFO)
+
+    # count and time every object storage and cache call, and every request
+    metrics = Metrics()
+    os_client = InstrumentedClient(os_client, metrics, "oci")
 
     # instantiate a cache for handling authentication and sharing functionality
-    # depending on arguments passed this will either be a local in-memory cache
-    # or will connect to an OCI Cache Service with Redis instance
+    # depending on arguments passed this will either be a local in-memory cache, a file
+    # shared by the workers on this host, or will connect to an OCI Cache Service with Redis instance
+    # (optionally fronted by an in-process cache)
     cache_type = "cloud"
     hostname = "local"
     if cmd.use_local_cache:
         cache_type = "local"
+    elif cmd.use_file_cache:
+        cache_type = "file"
+        hostname = cmd.cache_file
+    elif cmd.use_tiered_cache:
+        cache_type = "tiered"
+        hostname = cmd.redis_url
     else:
         hostname = cmd.redis_url
     logging.info(f"Using cache type '{cache_type}' with hostname '{hostname}'")
-    cache = CacheProviderFactory.get_cache_provider(cache_type, hostname)
+    cache_options = {}
+    if cache_type == "local":
+        cache_options = {"max_entries": cmd.local_cache_max_entries}
+    if cache_type in ("cloud", "tiered"):
+        cache_options = {
+            "port": cmd.redis_port,
+            "max_connections": cmd.redis_max_connections,
+            "socket_timeout": cmd.redis_timeout,
+            "health_check_interval": cmd.redis_health_check_interval,
+            "use_ssl": not cmd.redis_no_ssl,
+            "ssl_cert_reqs": cmd.redis_ssl_cert_reqs,
+            "ssl_ca_certs": cmd.redis_ca_certs,
+        }
+    if cache_type == "tiered":
+        cache_options.update(max_entries=cmd.local_cache_max_entries, local_ttl=cmd.local_cache_ttl)
+    cache_provider = CacheProviderFactory.get_cache_provider(cache_type, hostname, **cache_options)
+    cache = InstrumentedClient(cache_provider, metrics, "cache", count_hits=True)
+
+    # production workers share their metrics so that a scrape of any worker reports all of them.
+    # the publisher uses the provider directly so that it doesn't count its own cache calls
+    metrics_publisher = None
+    if cmd.server == "production" and cmd.workers > 1:
+        metrics_publisher = MetricsPublisher(metrics, cache_provider)
+        metrics_publisher.start()
+
+    # build the catalog index once (or load it from the boot snapshot) and keep it fresh in
+    # the background so that page renders never have to list the bucket
+    catalog = CatalogIndex(cmd, os_client, namespace, cache, cmd.catalog_ttl, cmd.catalog_full_refresh, snapshot)
+    catalog.start()
+
+    # pool of live PARs shared by all workers through the cache
+    par_manager = ParManager(cmd, os_client, namespace, cache, cmd.par_lifetime, cmd.par_min_remaining)
+    playlist_proxy = PlaylistProxy(cmd, os_client, namespace, cache, par_manager)
+
+    # optionally stream video through the app from a local chunk cache instead of sending
+    # players straight to object storage
+    stream_proxy = None
+    prefetcher = None
+    if cmd.use_stream:
+        chunk_size = cmd.stream_chunk_size*1024*1024
+        chunk_cache = ChunkCache(cmd.stream_cache_dir, cmd.stream_cache_size*1024*1024, chunk_size)
+
+        # optionally prefetch upcoming HLS segments into a segment store of their own
+        prefetch_cache = None
+        if cmd.use_prefetch:
+            prefetch_cache = ChunkCache(cmd.prefetch_cache_dir, cmd.prefetch_cache_size*1024*1024, chunk_size)
+        stream_proxy = StreamProxy(cmd, os_client, namespace, chunk_cache, prefetch_cache)
+        if prefetch_cache is not None:
+            prefetcher = Prefetcher(stream_proxy, playlist_proxy, prefetch_cache, cmd.prefetch_segments, cmd.prefetch_window, cmd.prefetch_workers, cmd.prefetch_idle_timeout)
+            prefetcher.start()
+
+    # QR logins are pushed to the login page (server-sent events or long polls) only under gevent
+    # workers, where a waiting request doesn't hold one of the few worker threads
+    long_polling = cmd.server == "production" and cmd.worker_class == "gevent"
+
+    # optionally limit how fast each client may hit the routes that call object storage
+    rate_limiter = None
+    if cmd.use_rate_limit:
+        rate_limiter = RateLimiter(cache, cmd.rate_limit_rate, cmd.rate_limit_burst)
+
+    metrics.describe("http_request_seconds", "Latency of requests by route, method and status")
+    metrics.describe("rate_limited_total", "Requests turned away by the rate limiter by route")
+    metrics.gauge("catalog_videos", lambda: len(catalog.get_catalog()), "Videos in the catalog index")
+    metrics.gauge("catalog_age_seconds", lambda: time.time() - catalog.built, "Seconds since the bucket was last checked for changes")
+    metrics.gauge("cache_hit_ratio", lambda: cache_hit_ratio(), "Share of cache lookups that found a value")
+
+    # templates and static files change only on deploy; their digest versions etags and static urls
+    asset_version = directory_digest(os.path.join(app.root_path, app.template_folder)) + directory_digest(app.static_folder)
+
+    # optionally delete expired PARs in the background
+    par_reaper = None
+    if cmd.use_par_reaper:
+        par_reaper = ParReaper(cmd, os_client, namespace, cache, cmd.par_reaper_interval, cmd.par_reaper_batch)
+        par_reaper.start()
+
+    # optionally compute durations, resolutions and posters of titles in the background
+    metadata_index = None
+    if cmd.use_metadata:
+        metadata_index = MetadataIndex(cmd, catalog, playlist_proxy, par_manager, cache, cmd.metadata_interval, cmd.metadata_workers)
+        metadata_index.start()
 
     @app.route('/')
     @login_required
     def home():
-        #
-        # movie list is a dictionary of top level directories with an array of json objects of 
-        # object paths and display names.  Example:
-        # movie_list["folder1"] = [{name=foo1, display_name=bar1}, {name=foo2, display_name=bar2}]
-        # movie_list["folder2"] = [{name=foo3, display_name=bar3}]
-        #
-        movie_list = {}
-
-        #
-        # exclude_list is a list that contains prefixes that we want to exclude from further file
-        # processing.  this is because we want to represent a single entry for an HLS folder tied to the
-        # the output.m3u8 playlist and not all of the underlying segment files
-        exclude_list = []
-
-        next_starts_with = None
-        while True:
-            try:
-                response = os_client.list_objects(namespace, cmd.bucket, start=next_starts_with, prefix="", fields='size,timeCreated,timeModified,storageTier', retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
-                next_starts_with = response.data.next_start_with
-                for object_file in response.data.objects:  
-                    movie_list, exclude_list = add_object(movie_list, exclude_list, object_file)  
-                if not next_starts_with:
-                    break
-            except Exception as e:
-                flash('Error interacting with video repository')
-                logging.debug("Error fetching object list: ")
-                logging.debug(e)
-                return render_template('home.html', sections=[], section_objects=[])
+        movie_catalog = catalog.get_catalog()
+        if not movie_catalog.folders:
+            flash('Error interacting with video repository')
+            return render_template('home.html', sections=[], section_objects=[])
 
-        keys = movie_list.keys()
+        keys = movie_catalog.sections()
 
         # get active tab if set in the request or populated in session
         active_tab = request.args.get("tab")
@@ -79,59 +175,99 @@ def create_app(cmd, os_client, namespace):
             if "active_tab" in session.keys():
                 active_tab = session["active_tab"]
             else:
-                active_tab = list(keys)[0]
+                active_tab = keys[0]
         session["active_tab"] = active_tab
 
+        # the page only changes with the catalog, the request and the tab, so repeat visits
+        # are answered with 304 Not Modified.  pages with a pending flash message are never cached
+        etag = None
+        if not session.get("_flashes"):
+            etag = make_etag(catalog.version, metadata_version(), asset_version, request.full_path, active_tab, current_user.get_id())
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+        # one page of the tab's titles, or of the titles matching a search, in the requested order
+        query = request.args.get("q", "").strip()
+        sort, descending = sort_args()
+        if query:
+            results = movie_catalog.search_index.search(query, active_tab, sort, descending)
+        else:
+            results = movie_catalog.search_index.listing(active_tab, sort, descending)
+        page = paginate(results, request.args.get("page", 1, type=int), PAGE_SIZE)
+
         # render template with clickable list of movies
-        return render_template('home.html', sections=keys, section_objects=movie_list[active_tab])
+        details = {video.name: title_details(video) for video in page["items"]}
+        response = make_response(render_template('home.html', sections=keys, section_objects=page["items"], details=details, page=page, query=query, sort=sort, sort_keys=list(SORT_KEYS)))
+        return with_etag(response, etag) if etag else response
+
+    #
+    # search titles by words of their display name (each word may be a prefix) across all
+    # folders, or one folder with the folder parameter.  returns one page of results as json
+    #
+    @app.route('/search')
+    @login_required
+    def search():
+        sort, descending = sort_args()
+        results = catalog.get_catalog().search_index.search(request.args.get("q", ""), request.args.get("folder"), sort, descending)
+        return jsonify(catalog_page(results, query=request.args.get("q", ""), sort=sort))
+
+    #
+    # paginated catalog as json, optionally limited to one folder.  sort is one of name,
+    # time_created or size; order is asc or desc (newest and largest first by default)
+    #
+    @app.route('/api/catalog')
+    @login_required
+    def api_catalog():
+        etag = make_etag(catalog.version, metadata_version(), request.full_path)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        movie_catalog = catalog.get_catalog()
+        sort, descending = sort_args()
+        results = movie_catalog.search_index.listing(request.args.get("folder"), sort, descending)
+        return with_etag(jsonify(catalog_page(results, folders=movie_catalog.sections(), sort=sort)), etag)
+
+    #
+    # poster frame of a title from the cache.  urls carry the title's etag so browsers can keep
+    # a poster until the title changes
+    #
+    @app.route('/poster')
+    @login_required
+    def poster():
+        name = request.args.get("name", "")
+        entry = metadata_index.get(name) if metadata_index is not None else None
+        jpeg = metadata_index.get_poster(name) if entry and entry.get("poster") else None
+        if jpeg is None:
+            return "Not found", 404
+        response = Response(jpeg, mimetype="image/jpeg")
+        response.set_etag(entry["etag"] or "")
+        response.cache_control.private = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        return response.make_conditional(request)
 
     @app.route('/movie')
     @login_required
     def detail():
-        # handle output differently depending on whether movie is HLS or not
-        is_hls = False
-
         # get name from request
         name = request.args.get("name")
         if name is None or len(name) < 5:
             flash('Missing or invalid video name')
             return redirect(url_for('home'))
-        
-        # strip folder name and suffix to build display name
-        try:
-            display_name = name.split("/",1)[1].rsplit(".", 1)[0]
-            prefix = name.rsplit("/",1)[0] + "/"
-            if ".hls" in display_name:
-                is_hls = True
-                display_name = display_name.split(".")[0]
-        except:
-            display_name = "Name not paresable"
+
+        # look up display name and whether movie is HLS or not in the catalog
+        video = find_video(name)
+        if video is None:
+            flash('Missing or invalid video name')
+            return redirect(url_for('home'))
+        display_name = video.display_name
+        is_hls = video.is_hls
 
         try:
-            # remove expired PARs
-            now = datetime.utcnow().replace(tzinfo=pytz.utc)
-            list_par_response = os_client.list_preauthenticated_requests(namespace, cmd.bucket)
-            for par in list_par_response.data:
-                if par.time_expires < now:
-                    os_client.delete_preauthenticated_request(namespace, cmd.bucket, par.id)
-
-            # create two hour PAR 
-            expiry_time = now + timedelta(hours=2)
-            par_response = os_client.create_preauthenticated_request(
-            namespace,
-            cmd.bucket,
-            create_preauthenticated_request_details=oci.object_storage.models.CreatePreauthenticatedRequestDetails(
-                name=name + str(expiry_time),
-                access_type="AnyObjectRead",
-                time_expires=expiry_time,
-                bucket_listing_action="Deny"
-                ))
-            
-            par_url = cmd.os_endpoint + par_response.data.access_uri + name
+            # reuse a pooled PAR with enough lifetime left or create a new one
+            par_url = video_url(video)
         except Exception as e:
                 flash('Error interacting with video repository')
-                logging.debug("Error listing/creating PARs: ")
-                logging.debug(e)
+                logging.debug("Error listing/creating PARs: %s", e)
                 return render_template('home.html', sections=[], section_objects=[])
         
         # set the encoding type depending on whether this is HLS or not
@@ -140,8 +276,12 @@ def create_app(cmd, os_client, namespace):
         else:
             encoding_type = "video/mp4"
 
+        # start warming the first segments while the player loads
+        if prefetcher is not None:
+            prefetcher.begin(viewer_id(), video)
+
         # render the template
-        return render_template('detail.html', par_url=par_url, video_name=display_name, full_name=name, encoding_type=encoding_type)
+        return render_template('detail.html', prefetch=prefetcher is not None, par_url=par_url, video_name=display_name, full_name=name, encoding_type=encoding_type)
     
     @app.route('/shared')
     def shared():
@@ -153,50 +293,26 @@ def create_app(cmd, os_client, namespace):
             logging.error("Missing auth_code in share attempt")
             return render_template("auth_result.html", result=generic_error)
         
-        # validate that the auth_code is valid
-        name = cache.get_shared(auth_code)
+        # validate that the auth_code is valid, fetching the pooled PAR of the video with it
+        name, par_entry = cache.get_shared_with_par(auth_code)
         if name == None:
             logging.error("Invalid auth_code in share attempt")
             return render_template("auth_result.html", result=generic_error)
         
-        # handle output differently depending on whether movie is HLS or not
-        is_hls = False
-
-        # strip folder name and suffix to build display name
-        try:
-            display_name = name.split("/",1)[1].rsplit(".", 1)[0]
-            prefix = name.rsplit("/",1)[0] + "/"
-            if ".hls" in display_name:
-                is_hls = True
-                display_name = display_name.split(".")[0]
-        except:
-            display_name = "Name not paresable"
+        # look up display name and whether movie is HLS or not in the catalog
+        video = find_video(name)
+        if video is None:
+            logging.error("Unparsable video name in share attempt")
+            return render_template("auth_result.html", result=generic_error)
+        display_name = video.display_name
+        is_hls = video.is_hls
 
         try:
-            # remove expired PARs
-            now = datetime.utcnow().replace(tzinfo=pytz.utc)
-            list_par_response = os_client.list_preauthenticated_requests(namespace, cmd.bucket)
-            for par in list_par_response.data:
-                if par.time_expires < now:
-                    os_client.delete_preauthenticated_request(namespace, cmd.bucket, par.id)
-
-            # create two hour PAR 
-            expiry_time = now + timedelta(hours=2)
-            par_response = os_client.create_preauthenticated_request(
-            namespace,
-            cmd.bucket,
-            create_preauthenticated_request_details=oci.object_storage.models.CreatePreauthenticatedRequestDetails(
-                name=name + str(expiry_time),
-                access_type="AnyObjectRead",
-                time_expires=expiry_time,
-                bucket_listing_action="Deny"
-                ))
-            
-            par_url = cmd.os_endpoint + par_response.data.access_uri + name
+            # reuse a pooled PAR with enough lifetime left or create a new one
+            par_url = video_url(video, auth_code, par_entry)
         except Exception as e:
                 flash('Error interacting with video repository')
-                logging.debug("Error listing/creating PARs: ")
-                logging.debug(e)
+                logging.debug("Error listing/creating PARs: %s", e)
                 return render_template('home.html', sections=[], section_objects=[])
         
         # set the encoding type depending on whether this is HLS or not
@@ -205,35 +321,183 @@ def create_app(cmd, os_client, namespace):
         else:
             encoding_type = "video/mp4"
 
+        # start warming the first segments while the player loads
+        if prefetcher is not None:
+            prefetcher.begin(viewer_id(), video)
+
         # render the template
-        return render_template('shared.html', par_url=par_url, video_name=display_name, encoding_type=encoding_type)
+        return render_template('shared.html', prefetch=prefetcher is not None, full_name=name, par_url=par_url, video_name=display_name, encoding_type=encoding_type)
     
+    #
+    # HLS playlist with segment uris rewritten against the title's folder-scoped PAR.  available
+    # to logged in users and to holders of a share code for the same title
+    #
+    @app.route('/playlist')
+    def playlist():
+        video = authorize_hls(request.args.get("name"), request.args.get("auth_code"))
+        if video is None:
+            return "Not found", 404
+
+        # when streaming through the app segments are served by /stream, otherwise straight from object storage
+        segment_url = None
+        if stream_proxy is not None:
+            auth_code = request.args.get("auth_code")
+            segment_url = lambda segment_name: url_for("stream", name=segment_name, auth_code=auth_code)
+
+        try:
+            text = playlist_proxy.render(video, segment_url)
+        except Exception as e:
+            logging.error("Error rendering playlist: " + str(e))
+            return "Error interacting with video repository", 502
+        return Response(text, mimetype="application/vnd.apple.mpegurl", headers={"Cache-Control": "private, max-age=60"})
+
+    #
+    # master playlist across every rendition of an HLS title so the player can adapt bitrate
+    #
+    @app.route('/master_playlist')
+    def master_playlist():
+        auth_code = request.args.get("auth_code")
+        video = authorize_hls(request.args.get("name"), auth_code)
+        if video is None:
+            return "Not found", 404
+
+        renditions = [(url_for("playlist", name=rendition.name, auth_code=auth_code), rendition.display_name) for rendition in catalog.get_catalog().find_renditions(video)]
+        return Response(render_master_playlist(renditions), mimetype="application/vnd.apple.mpegurl", headers={"Cache-Control": "private, max-age=60"})
+
+    #
+    # stream a video or HLS segment through the app with HTTP Range support.  only registered
+    # when the app is started with --stream
+    #
+    def stream():
+        name = request.args.get("name")
+        if not name or not (current_user.is_authenticated or share_allows(request.args.get("auth_code"), name)):
+            return "Not found", 404
+
+        if prefetcher is not None:
+            prefetcher.touch(viewer_id(), name)
+
+        try:
+            return stream_proxy.response(name, request.headers.get("Range"), request.environ, catalog.get_catalog().lookup(name))
+        except oci.exceptions.ServiceError as e:
+            if e.status == 404:
+                return "Not found", 404
+            logging.error("Error streaming object: " + str(e))
+            return "Error interacting with video repository", 502
+        except Exception as e:
+            logging.error("Error streaming object: " + str(e))
+            return "Error interacting with video repository", 502
+
+    #
+    # beacon sent by the player page when the viewer leaves so queued prefetches are cancelled
+    #
+    def prefetch_stop():
+        name = request.args.get("name")
+        if name:
+            prefetcher.end(viewer_id(), name)
+        return "", 204
+
+    @login_required
+    def prefetch_stats():
+        return jsonify(prefetcher.stats())
+
+    if stream_proxy is not None:
+        app.add_url_rule('/stream', 'stream', stream)
+    if prefetcher is not None:
+        app.add_url_rule('/prefetch/stop', 'prefetch_stop', prefetch_stop, methods=['POST'])
+        app.add_url_rule('/admin/prefetch', 'prefetch_stats', prefetch_stats)
+
     @app.route('/share_url', methods=['GET', 'POST'])
     @login_required
     def share_url():
         auth_code = str(uuid.uuid4())
         name = unescape(request.json.get("name"))
         cache.set_shared(auth_code, name)
-        target_url = request.url_root + url_for("shared") + "?auth_code=" + auth_code
-        return jsonify(url=target_url)
+        return jsonify(url=shared_url(auth_code))
 
+    #
+    # share links for several titles ({"names": [...]}) or every title in a folder
+    # ({"folder": "..."}) at once.  the share codes are written in one batch, a single round
+    # trip with Redis
+    #
+    @app.route('/share_urls', methods=['POST'])
+    @login_required
+    def share_urls():
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict) or not isinstance(body.get("folder") or "", str) or not isinstance(body.get("names") or [], list):
+            return jsonify(error="expected a folder name or a list of names"), 400
+        if body.get("folder"):
+            names = [video.name for video in catalog.get_catalog().videos(body["folder"])]
+        else:
+            names = [unescape(name) for name in body.get("names") or [] if isinstance(name, str)]
+        if not names:
+            return jsonify(error="no titles to share"), 400
+        if len(names) > MAX_BULK_SHARES:
+            return jsonify(error=f"at most {MAX_BULK_SHARES} titles can be shared at once"), 400
+
+        shares = {str(uuid.uuid4()): name for name in names}
+        cache.set_shared_many(shares)
+        return jsonify(links=[{"name": name, "url": shared_url(auth_code)} for auth_code, name in shares.items()])
+
+    #
+    # polled by the login page to find out whether the QR code login completed.  a single key
+    # lookup, or with wait=N a long poll that returns as soon as the session is authenticated
+    #
     @app.route('/check_auth')
     def check_auth():
         is_authenticated = False
         session_id = request.args.get('session_id')
-        logging.debug("check_auth:id: " + session_id)
-        logging.debug("DICT: " + json.dumps(cache.get_authenticated_dict(), indent=2))
+        wait = min(request.args.get('wait', 0, type=float), MAX_AUTH_WAIT) if long_polling else 0
+        logging.debug("check_auth:id: %s", session_id)
         if session_id:
             try:
-                is_authenticated = cache.get_authenticated(session_id)
-                logging.debug("check_auth:is_authenticated: " + str(is_authenticated))
+                if wait > 0:
+                    is_authenticated = cache.wait_authenticated(session_id, wait)
+                else:
+                    is_authenticated = cache.get_authenticated(session_id)
+                logging.debug("check_auth:is_authenticated: %s", is_authenticated)
                 if is_authenticated:
                     login_user(User(cmd.username))
             except:
                 is_authenticated = False
-                logging.debug("check_auth:is_authenticated: " + str(is_authenticated))
+                logging.debug("check_auth:is_authenticated: %s", is_authenticated)
         return jsonify(is_authenticated=is_authenticated)
 
+    #
+    # server-sent events variant of check_auth.  streams a keepalive every MAX_AUTH_WAIT seconds
+    # and a final event once the session is authenticated; the page then calls check_auth once
+    # to log in since the session cookie can't be set on a streaming response
+    #
+    @app.route('/auth_events')
+    def auth_events():
+        session_id = request.args.get('session_id')
+        if not session_id:
+            return jsonify(error="missing session_id"), 400
+
+        # without gevent a held stream would pin a worker thread, so answer once and have the
+        # browser reconnect in 5 seconds like a short poll
+        if not long_polling:
+            is_authenticated = cache.get_authenticated(session_id)
+            return Response("retry: 5000\ndata: " + json.dumps({"is_authenticated": is_authenticated}) + "\n\n", mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+        def stream():
+            deadline = time.time() + AUTH_EVENTS_DURATION
+            # stop streaming once the login session expires
+            while time.time() < deadline and cache.is_session_in_authenticated(session_id):
+                is_authenticated = cache.wait_authenticated(session_id, MAX_AUTH_WAIT)
+                yield "data: " + json.dumps({"is_authenticated": is_authenticated}) + "\n\n"
+                if is_authenticated:
+                    return
+
+        return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    #
+    # debug view of outstanding auth sessions
+    #
+    @app.route('/admin/auth_sessions')
+    @login_required
+    def auth_sessions():
+        return jsonify(cache.get_authenticated_dict())
+
     @app.route('/authenticate', methods=['GET'])
     def authenticate():
         session_id = request.args.get('session_id')
@@ -244,10 +508,9 @@ def create_app(cmd, os_client, namespace):
         session_id = request.form.get('session_id')
         username = request.form.get('username')
         password = request.form.get('password')
-        logging.debug("authenticate_post:" + str(session_id)+":"+username+":"+password)
         if username == cmd.username and password == cmd.password and session_id and cache.is_session_in_authenticated(session_id):
             cache.set_authenticated(session_id, True)
-            logging.info("Success authenticating id: " + session_id)
+            logging.info("Success authenticating id: %s", session_id)
             return render_template("auth_result.html", result="Success. Your viewing device should refresh momentarily. ")
         return render_template("auth_result.html", result="Unable to authenticate. Please check your head and try again.")
 
@@ -256,7 +519,7 @@ def create_app(cmd, os_client, namespace):
         session_id = str(uuid.uuid4())
         cache.set_authenticated(session_id, False)
         target_url = request.url_root + url_for("authenticate") + "?session_id=" + session_id
-        return render_template('login.html', target_url=target_url, session_id=session_id)
+        return render_template('login.html', target_url=target_url, session_id=session_id, push=long_polling)
 
     @app.route('/login', methods=['POST'])
     def login_post():
@@ -277,6 +540,55 @@ def create_app(cmd, os_client, namespace):
         logout_user()
         return redirect(url_for('home'))
     
+    #
+    # counts and timings of the background PAR reaper
+    #
+    @app.route('/admin/par_reaper')
+    @login_required
+    def par_reaper_stats():
+        if par_reaper is None:
+            return jsonify(enabled=False)
+        return jsonify(enabled=True, **par_reaper.stats())
+
+    #
+    # webhook for object storage events delivered by an OCI Notifications HTTPS subscription, so
+    # uploads and deletes show up without waiting for the next catalog refresh.  only registered
+    # when the app is started with --events_token, which must be passed as the token parameter
+    #
+    def object_events():
+        if not secrets.compare_digest(request.args.get("token", ""), cmd.events_token):
+            return "Not found", 404
+
+        # the subscription has to be confirmed once by visiting this url
+        confirmation_url = request.headers.get("X-OCI-NS-ConfirmationURL")
+        if confirmation_url:
+            logging.warning("Confirm the object event subscription by visiting " + confirmation_url)
+            return "", 204
+
+        payload = request.get_json(silent=True)
+        events = payload if isinstance(payload, list) else [payload]
+        # reject the batch before applying any of it, since the sender retries the whole batch
+        if not all(valid_event(event) for event in events):
+            return jsonify(error="invalid event"), 400
+        changed = 0
+        for event in events:
+            bucket = (event["data"].get("additionalDetails") or {}).get("bucketName")
+            if bucket and bucket != cmd.bucket:
+                continue
+            try:
+                changed += catalog.apply_event(event.get("eventType", ""), event["data"].get("resourceName", ""))
+            except Exception as e:
+                logging.error("Error applying object event: " + str(e))
+                return "Error interacting with video repository", 502
+        return jsonify(changed=changed)
+
+    def valid_event(event) -> bool:
+        return (isinstance(event, dict) and isinstance(event.get("eventType", ""), str) and isinstance(event.get("data"), dict)
+                and isinstance(event["data"].get("resourceName", ""), str) and isinstance(event["data"].get("additionalDetails") or {}, dict))
+
+    if cmd.events_token:
+        app.add_url_rule('/events/object', 'object_events', object_events, methods=['POST'])
+
     # 
     # health check endpoint for load balancer and OCI Health Check Service
     #
@@ -284,6 +596,80 @@ def create_app(cmd, os_client, namespace):
     def health():
         return "i'm feeling good from my head to my shoes!"
     
+    #
+    # static urls carry the asset version so they can be cached for a long time and still
+    # change on deploy
+    #
+    @app.url_defaults
+    def static_version(endpoint, values):
+        if endpoint == "static" and "v" not in values:
+            values["v"] = asset_version
+
+    #
+    # long-lived cache headers for versioned static files and compression of html and json
+    #
+    @app.after_request
+    def cache_and_compress(response):
+        if request.endpoint == "static" and request.args.get("v") == asset_version:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        return compress_response(response, request.accept_encodings)
+
+    #
+    # request latency by route.  with --server_timing every response also carries a
+    # Server-Timing header splitting the time between the app, object storage and the cache
+    #
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    #
+    # each client may make --rate_limit_burst requests to a limited route at once and then
+    # --rate_limit_rate per second.  requests beyond that get a 429 with Retry-After
+    #
+    @app.before_request
+    def rate_limit():
+        if rate_limiter is None or request.endpoint not in RATE_LIMITED_ENDPOINTS:
+            return None
+        retry_after = rate_limiter.check(request.remote_addr, request.endpoint)
+        if retry_after > 0:
+            metrics.increment("rate_limited_total", {"route": request.endpoint})
+            return Response("Too many requests, please try again shortly", status=429, headers={"Retry-After": str(math.ceil(retry_after))})
+        return None
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("http_request_seconds", {"route": route, "method": request.method, "status": response.status_code}, elapsed)
+        if cmd.server_timing:
+            timings = g.get("dependency_timings", {})
+            entries = [f"app;dur={elapsed * 1000:.1f}"] + [f"{dependency};dur={seconds * 1000:.1f}" for dependency, seconds in timings.items()]
+            response.headers["Server-Timing"] = ", ".join(entries)
+        return response
+
+    #
+    # metrics of every worker process on this host in the Prometheus text format.  available to
+    # logged in users, or to a scraper passing --metrics_token as a bearer token
+    #
+    @app.route('/metrics')
+    def metrics_endpoint():
+        authorization = request.headers.get("Authorization", "")
+        token_ok = cmd.metrics_token and secrets.compare_digest(authorization, "Bearer " + cmd.metrics_token)
+        if not (token_ok or current_user.is_authenticated):
+            return "Not found", 404
+        if metrics_publisher is not None:
+            try:
+                metrics_publisher.collect()
+            except Exception as e:
+                logging.error("Error collecting metrics of the other workers: " + str(e))
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     #
     # session timeout helper method
     #
@@ -292,55 +678,124 @@ def create_app(cmd, os_client, namespace):
         session.permanent = True
         app.permanent_session_lifetime = timedelta(minutes=120)
 
+    # conditional GET helpers.  etags are weak since the body may be sent compressed, and
+    # responses are private since they depend on the login session
+    def with_etag(response, etag):
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
+
+    def not_modified(etag):
+        return with_etag(Response(status=304), etag)
+
+    def cache_hit_ratio():
+        hits = metrics.total("cache_lookups_total", result="hit")
+        misses = metrics.total("cache_lookups_total", result="miss")
+        return hits / (hits + misses) if hits + misses else 0
+
+    # sort key and direction from the request arguments
+    def sort_args():
+        sort = request.args.get("sort", "name")
+        if sort not in SORT_KEYS:
+            sort = "name"
+        order = request.args.get("order")
+        return sort, (None if order not in ("asc", "desc") else order == "desc")
+
+    def catalog_page(results, **extra):
+        page = paginate(results, request.args.get("page", 1, type=int), PAGE_SIZE)
+        page["items"] = [{
+            "name": video.name,
+            "display_name": video.display_name,
+            "folder": video.folder,
+            "is_hls": video.is_hls,
+            "size": video.size,
+            "time_created": video.time_created,
+            "url": url_for("detail", name=video.name),
+            **title_metadata(video),
+        } for video in page["items"]]
+        return dict(extra, **page)
+
+    # duration, resolution, renditions and poster url of a title once they are computed
+    def title_metadata(video):
+        entry = metadata_index.get(video.name) if metadata_index is not None else None
+        if not entry or entry.get("etag") != video.etag:
+            return {}
+        values = {key: entry[key] for key in ("duration", "width", "height", "renditions") if key in entry}
+        if entry.get("poster"):
+            values["poster"] = url_for("poster", name=video.name, v=video.etag)
+        return values
+
+    # what the home page shows next to a title: a poster url and a short summary
+    def title_details(video):
+        values = title_metadata(video)
+        entry = dict(values, size=video.size)
+        return {"poster": values.get("poster"), "summary": summary(entry)}
+
+    def metadata_version():
+        return metadata_index.version if metadata_index is not None else 0
+
     #
-    # helper method to build the in-memory representation of the navigation
+    # random id kept in the session cookie that tells apart viewers of the same title
     #
-    def add_object(movie_list, exclude_list, object_file):
-        try:
-            # decode directory and filename
-            split_str = object_file.name.split("/", 1)
-            dir = split_str[0]
-            name = split_str[1]
-
-            # if there is no file we just got a directory from os; ignore
-            if len(name) < 1:
-                return movie_list, exclude_list
-            
-            # check the name to see if it contains a directory in the exclude_list
-            # if it does, it means we have already processed the playlist and this is just
-            # a segment file which means that we should skip it
-            if ".hls/" in name:
-                name_split = name.split(".")
-                if name_split[0] in exclude_list:
-                    return movie_list, exclude_list
-                
-            # check to see if directory exists in dictionary.  if not create
-            if not dir in movie_list:
-                movie_list[dir] = []
-
-            ## find the playlist (output.m3u8) and add it to the index.  otherwise do normal file processing
-            if ".hls/" in name:
-                if "output.m3u8" in name:
-                    object_name = object_file.name
-                    # get a display name without the extension
-                    display_name = name.rsplit("/", 1)[0]
-                    display_name = display_name.rsplit(".", 1)[0]
-                    exclude_list.append(display_name)
-                else:
-                    return movie_list, exclude_list
-            else:
-                object_name = object_file.name
-                # get a display name without the extension
-                display_name = name.rsplit(".", 1)[0]
-            
-            # build video object and append to the right heading
-            video = {"name": object_name, "display_name": display_name}
-            movie_list[dir].append(video)
-        except Exception as e:
-            logging.error("add_object error: " + str(e))
+    def viewer_id():
+        if "viewer" not in session:
+            session["viewer"] = secrets.token_hex(8)
+        return session["viewer"]
+
+    #
+    # find a video in the catalog index.  titles uploaded since the last refresh are not in the
+    # index yet so fall back to parsing the object name
+    #
+    def find_video(name):
+        return catalog.get_catalog().lookup(name) or Video.parse(name)
+
+    # link that opens a share code
+    def shared_url(auth_code):
+        return request.url_root + url_for("shared") + "?auth_code=" + auth_code
+
+    #
+    # url handed to the player.  HLS players load the playlist through the app (a master
+    # playlist when the title has several renditions); mp4s are read straight from object storage
+    # through a pooled PAR, par_entry when the caller already looked it up
+    #
+    def video_url(video, auth_code=None, par_entry=None):
+        if not video.is_hls:
+            if stream_proxy is not None:
+                return url_for("stream", name=video.name, auth_code=auth_code)
+            return par_manager.get_par_url(video, par_entry)
+        if len(catalog.get_catalog().find_renditions(video)) > 1:
+            return url_for("master_playlist", name=video.name, auth_code=auth_code)
+        return url_for("playlist", name=video.name, auth_code=auth_code)
+
+    # return the HLS video if the user is logged in or holds a share code for the same title
+    def authorize_hls(name, auth_code):
+        video = find_video(name) if name else None
+        if video is None or not video.is_hls:
+            return None
+        if current_user.is_authenticated or share_allows(auth_code, name):
+            return video
+        return None
+
+    #
+    # a share code grants the shared video and, for HLS titles, every object in the folders of
+    # all renditions of that title (playlists and segments)
+    #
+    def share_allows(auth_code, name):
+        if not auth_code:
+            return False
+        shared_video = find_video(cache.get_shared(auth_code) or "")
+        if shared_video is None:
+            return False
+        if name == shared_video.name:
+            return True
+        if not shared_video.is_hls or HLS_SUFFIX not in name:
+            return False
+        # the playlist of the HLS folder the requested object is in, compared by stripped title
+        requested = Video.parse(name.split(HLS_SUFFIX, 1)[0] + HLS_SUFFIX + HLS_PLAYLIST)
+        return requested is not None and requested.folder == shared_video.folder and requested.title == shared_video.title
 
-        return movie_list, exclude_list
-    
     return app
 
 class User(UserMixin):
@@ -0,0 +1,75 @@
+import logging
+import threading
+
+#
+# Base class for indexes that one worker at a time computes and every worker serves from an
+# in-process copy (the catalog and the title metadata).  The shared copy lives in the cache
+# provider under two keys so that workers can cheaply poll for changes:
+# META_KEY = {"version": 1712345678.9, ...fields from meta_fields()}
+# CACHE_KEY = {"version": 1712345678.9, FIELD: <the index as json>}
+# version is the time the index last changed.  Only the worker holding LOCK_NAME computes a new
+# version.  Subclasses provide refresh(), called by the poll thread, and adopt(), which
+# installs an index read from the cache.
+#
+class SharedIndex:
+    CACHE_KEY = None
+    META_KEY = None
+    LOCK_NAME = None
+    FIELD = None
+    # used in the poll thread name and in log messages
+    NAME = None
+    POLL_INTERVAL = 5
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.version = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    # adopt the shared copy if another worker changed it.  returns the meta, or None when
+    # nothing was published yet
+    def sync(self):
+        meta = self.cache.get_value(self.META_KEY)
+        if not meta:
+            return None
+        if meta["version"] != self.version:
+            shared = self.cache.get_value(self.CACHE_KEY)
+            if shared and shared["version"] == meta["version"]:
+                with self.lock:
+                    self.adopt(shared[self.FIELD])
+                    self.version = shared["version"]
+        return meta
+
+    # share a new version of the index.  callers hold self.lock
+    def publish(self, value, version: float):
+        self.version = version
+        self.cache.set_value(self.CACHE_KEY, {"version": version, self.FIELD: value})
+        self.publish_meta()
+
+    # callers hold self.lock
+    def publish_meta(self):
+        self.cache.set_value(self.META_KEY, dict(self.meta_fields(), version=self.version))
+
+    def meta_fields(self) -> dict:
+        return {}
+
+    # seconds between two refreshes of the poll thread
+    def poll_wait(self) -> float:
+        return self.POLL_INTERVAL
+
+    def start_polling(self, first_wait: float):
+        self.thread = threading.Thread(target=self._run, args=(first_wait,), name=f"{self.NAME}-refresh", daemon=True)
+        self.thread.start()
+
+    def _run(self, first_wait: float):
+        wait = first_wait
+        while not self.stop_event.wait(wait):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error refreshing {self.NAME} index: " + str(e))
+            wait = self.poll_wait()
@@ -0,0 +1,50 @@
+import threading
+
+#
+# one call in flight for a key.  waiters block on done and then read result or error
+#
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+#
+# Request coalescing: concurrent callers asking for the same key share one execution of the
+# function instead of each running it.  The first caller runs it; callers that arrive while it
+# is in flight wait and get the same result (or exception).  Nothing is remembered once the call
+# completes, so callers are expected to check their cache before and inside the flight.  Works
+# across the threads (or greenlets under gevent) of one process; the PAR pool uses a cache lock
+# on top to coalesce across processes.
+#
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key: str, function):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
@@ -0,0 +1,236 @@
+from flask import Response
+from werkzeug.http import parse_range_header
+from cache import TTLCache
+from singleflight import SingleFlight
+import oci
+import os
+import mmap
+import time
+import hashlib
+import logging
+import tempfile
+import mimetypes
+import threading
+
+READ_SIZE = 256*1024
+CONTENT_TYPES = {".ts": "video/mp2t", ".m4s": "video/iso.segment", ".mp4": "video/mp4", ".m3u8": "application/vnd.apple.mpegurl"}
+
+#
+# Bounded on-disk LRU cache of fixed size chunks of objects.  Chunk files are named after the
+# object name, etag and chunk index so a re-uploaded object never serves stale bytes.  The
+# directory can be shared by every worker on the host: recency is the file mtime (touched on
+# every hit) and eviction rescans the directory, deleting the least recently used chunks until
+# the cache is back under 90% of max_bytes.
+#
+class ChunkCache:
+    def __init__(self, directory: str, max_bytes: int, chunk_size: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = self._scan_size()
+
+    def path(self, name: str, etag: str, index: int) -> str:
+        key = hashlib.sha1(f"{name}\0{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}-{index}.chunk")
+
+    # return the path of a cached chunk or None
+    def get(self, name: str, etag: str, index: int):
+        path = self.path(name, etag, index)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    # open a temporary file for a chunk being downloaded; commit() moves it into the cache
+    def open_temp(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        return os.fdopen(fd, "wb"), temp_path
+
+    def commit(self, temp_path: str, name: str, etag: str, index: int) -> str:
+        path = self.path(name, etag, index)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.size += size
+            over_budget = self.size > self.max_bytes
+        if over_budget:
+            self.evict()
+        return path
+
+    def evict(self):
+        with self.lock:
+            chunks = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".chunk"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    chunks.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            chunks.sort()
+            target = self.max_bytes * 0.9
+            for _, size, path in chunks:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self.size = total
+        logging.debug("Chunk cache evicted down to %d bytes", total)
+
+    def _scan_size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".chunk"))
+
+#
+# Streams objects from object storage through the app with HTTP Range support.  Objects are
+# read in chunk sized ranged get_object calls that are streamed to the client as they arrive
+# and written to the chunk cache, so whole files are never buffered.  Cached chunks are read
+# with mmap, and a range that falls within one cached chunk (i.e. an HLS segment) is handed to
+# the server as a file so gunicorn can send it with zero-copy sendfile.
+#
+class StreamProxy:
+    STAT_TTL = 60*60
+
+    def __init__(self, cmd, os_client, namespace, chunk_cache: ChunkCache, prefetch_cache: ChunkCache = None):
+        self.cmd = cmd
+        self.os_client = os_client
+        self.namespace = namespace
+        self.chunk_cache = chunk_cache
+        self.prefetch_cache = prefetch_cache
+        self.stats = TTLCache(10000)
+        self.flights = SingleFlight()
+
+    # size and etag of an object.  catalog videos already know theirs; segments are looked up once
+    def stat(self, name: str, video=None):
+        if video is not None and video.size is not None and video.etag:
+            return video.size, video.etag
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.flights.do(name, lambda: self._head(name))
+        return stat
+
+    def _head(self, name: str):
+        response = self.os_client.head_object(self.namespace, self.cmd.bucket, name, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+        stat = (int(response.headers["content-length"]), response.headers.get("etag"))
+        self.stats.set(name, stat, self.STAT_TTL)
+        return stat
+
+    def response(self, name: str, range_header: str, environ: dict, video=None) -> Response:
+        size, etag = self.stat(name, video)
+        headers = {"Accept-Ranges": "bytes", "ETag": f'"{etag}"', "Cache-Control": "private, max-age=3600"}
+        content_type = CONTENT_TYPES.get(os.path.splitext(name)[1].lower()) or mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        start, stop, status = 0, size, 200
+        byte_range = parse_range_header(range_header) if range_header else None
+        if byte_range is not None:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+            start, stop = bounds
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        headers["Content-Length"] = str(stop - start)
+
+        chunk_size = self.chunk_cache.chunk_size
+        first, last = start // chunk_size, max(start, stop - 1) // chunk_size
+        if first == last and "wsgi.file_wrapper" in environ:
+            chunk_file = self._open_cached(name, etag, first)
+            if chunk_file is not None:
+                chunk_file.seek(start - first * chunk_size)
+                body = environ["wsgi.file_wrapper"](chunk_file, READ_SIZE)
+                return Response(body, status=status, headers=headers, mimetype=content_type, direct_passthrough=True)
+
+        return Response(self._stream(name, etag, size, start, stop), status=status, headers=headers, mimetype=content_type, direct_passthrough=True)
+
+    def _stream(self, name: str, etag: str, size: int, start: int, stop: int):
+        chunk_size = self.chunk_cache.chunk_size
+        position = start
+        while position < stop:
+            index = position // chunk_size
+            chunk_start = index * chunk_size
+            chunk_stop = min(chunk_start + chunk_size, size)
+            offset = position - chunk_start
+            limit = min(stop, chunk_stop) - chunk_start
+
+            chunk_file = self._open_cached(name, etag, index)
+            if chunk_file is not None:
+                yield from self._read_cached(chunk_file, offset, limit)
+            else:
+                yield from self._fetch(self.chunk_cache, name, etag, index, chunk_start, chunk_stop, offset, limit)
+            position = chunk_start + limit
+
+    # download every chunk of an object that is not cached yet into cache without streaming it
+    def prefetch(self, name: str, cache: ChunkCache):
+        size, etag = self.stat(name)
+        chunk_size = self.chunk_cache.chunk_size
+        for index in range((size + chunk_size - 1) // chunk_size):
+            if self._cached(name, etag, index) is None:
+                chunk_start = index * chunk_size
+                for _ in self._fetch(cache, name, etag, index, chunk_start, min(chunk_start + chunk_size, size), 0, 0):
+                    pass
+
+    # path of a chunk in the stream cache or the prefetch store
+    def _cached(self, name: str, etag: str, index: int):
+        path = self.chunk_cache.get(name, etag, index)
+        if path is None and self.prefetch_cache is not None:
+            path = self.prefetch_cache.get(name, etag, index)
+        return path
+
+    # open a cached chunk, or None if it is not cached.  another worker may evict the chunk
+    # between the lookup and the open, in which case it is treated as not cached; once open the
+    # chunk stays readable even if it is evicted
+    def _open_cached(self, name: str, etag: str, index: int):
+        path = self._cached(name, etag, index)
+        if path is None:
+            return None
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+    # memory map the chunk and yield the requested slice of it
+    def _read_cached(self, chunk_file, offset: int, limit: int):
+        with chunk_file:
+            with mmap.mmap(chunk_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for position in range(offset, limit, READ_SIZE):
+                    yield mapped[position:min(position + READ_SIZE, limit)]
+
+    # download a whole chunk into cache, yielding the requested slice as it arrives.
+    # if the client goes away before the chunk completes the partial download is discarded
+    def _fetch(self, cache: ChunkCache, name: str, etag: str, index: int, chunk_start: int, chunk_stop: int, offset: int, limit: int):
+        started = time.time()
+        response = self.os_client.get_object(self.namespace, self.cmd.bucket, name, range=f"bytes={chunk_start}-{chunk_stop - 1}", retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+        committed = False
+        temp_file = temp_path = None
+        try:
+            temp_file, temp_path = cache.open_temp()
+            position = 0
+            for data in response.data.raw.stream(READ_SIZE, decode_content=False):
+                temp_file.write(data)
+                piece_start = max(offset, position)
+                piece_stop = min(limit, position + len(data))
+                if piece_start < piece_stop:
+                    yield data[piece_start - position:piece_stop - position]
+                position += len(data)
+            temp_file.close()
+            if position == chunk_stop - chunk_start:
+                cache.commit(temp_path, name, etag, index)
+                committed = True
+                logging.debug("Cached chunk %d of '%s' in %.2fs", index, name, time.time() - started)
+        finally:
+            # return the connection to the pool even when the viewer goes away mid chunk
+            response.data.close()
+            if temp_file is not None:
+                temp_file.close()
+            if temp_path is not None and not committed:
+                try:
+                    os.remove(temp_path)
+                except FileNotFoundError:
+                    pass